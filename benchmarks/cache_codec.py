@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Compares ways of encoding large cache values: stored size, encode time and decode time.
+
+Payloads are read from the Redis at REDIS_URL when it has them (transit:routes, transit:stops,
+calendar:3year, dining:venues). Otherwise transit stops and routes are built from stops.json.
+
+Usage:
+
+    REDIS_URL=redis://localhost:6379 python benchmarks/cache_codec.py
+
+"""
+import gzip
+import json
+import os
+import random
+import timeit
+import zlib
+
+import redis
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEYS = ["transit:routes", "transit:stops", "calendar:3year", "dining:venues"]
+
+
+def compact_json(data):
+    return json.dumps(data, separators=(",", ":")).encode("utf8")
+
+
+CODECS = [
+    ("json", compact_json, lambda x: json.loads(x.decode("utf8"))),
+    ("json+gzip-1", lambda x: gzip.compress(compact_json(x), 1), lambda x: json.loads(gzip.decompress(x))),
+    ("json+gzip-6", lambda x: gzip.compress(compact_json(x), 6), lambda x: json.loads(gzip.decompress(x))),
+    ("json+gzip-9", lambda x: gzip.compress(compact_json(x), 9), lambda x: json.loads(gzip.decompress(x))),
+    ("json+zlib-6", lambda x: zlib.compress(compact_json(x), 6), lambda x: json.loads(zlib.decompress(x))),
+]
+if msgpack:
+    CODECS += [
+        ("msgpack", msgpack.packb, msgpack.unpackb),
+        ("msgpack+zlib-6", lambda x: zlib.compress(msgpack.packb(x), 6), lambda x: msgpack.unpackb(zlib.decompress(x))),
+    ]
+
+
+def decode_entry(value):
+    """Decodes a value written by server.base without importing the app."""
+    if not value.startswith(b"\x01"):
+        return json.loads(value.decode("utf8"))
+    meta, _, body = value[1:].partition(b"\n")
+    if json.loads(meta.decode("utf8")).get("encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body.decode("utf8"))
+
+
+def redis_payloads():
+    try:
+        db = redis.StrictRedis().from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+        values = db.mget(KEYS)
+    except redis.exceptions.ConnectionError:
+        return {}
+    return {key: decode_entry(value) for key, value in zip(KEYS, values) if value is not None}
+
+
+def fixture_payloads():
+    with open(os.path.join(ROOT, "stops.json")) as f:
+        stops = json.load(f)
+
+    # Routes look like the stops, plus a few dozen waypoints on the way to each stop
+    rand = random.Random(0)
+    routes = []
+    for name in ["Campus Loop", "PennBUS East", "PennBUS West"]:
+        route_stops = []
+        for order, stop in enumerate(rand.sample(stops["result_data"], 20)):
+            stop = dict(stop, order=order)
+            stop["path_to"] = [
+                {
+                    "Latitude": stop["Latitude"] + rand.uniform(-0.01, 0.01),
+                    "Longitude": stop["Longitude"] + rand.uniform(-0.01, 0.01),
+                }
+                for _ in range(40)
+            ]
+            route_stops.append(stop)
+        routes.append({"route_name": name, "stops": route_stops})
+    return {"transit:stops": stops, "transit:routes": {"result_data": routes}}
+
+
+def main():
+    payloads = fixture_payloads()
+    payloads.update(redis_payloads())
+
+    print("%-16s %-16s %10s %7s %10s %10s" % ("payload", "codec", "bytes", "ratio", "encode ms", "decode ms"))
+    for key, data in sorted(payloads.items()):
+        baseline = len(compact_json(data))
+        for name, encode, decode in CODECS:
+            encoded = encode(data)
+            assert decode(encoded) == data
+            runs = 20
+            encode_ms = min(timeit.repeat(lambda: encode(data), number=runs, repeat=3)) / runs * 1000
+            decode_ms = min(timeit.repeat(lambda: decode(encoded), number=runs, repeat=3)) / runs * 1000
+            print(
+                "%-16s %-16s %10d %7.2f %10.3f %10.3f"
+                % (key, name, len(encoded), len(encoded) / float(baseline), encode_ms, decode_ms)
+            )
+
+
+if __name__ == "__main__":
+    main()
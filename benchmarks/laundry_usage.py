@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Compares the NumPy usage computation in server.laundry with the loop it replaced.
+
+Both are run on a synthetic year of hourly LaundryUsage rows for every laundry hall, and must
+produce identical usage data.
+
+Usage:
+
+    python benchmarks/laundry_usage.py
+
+"""
+import calendar
+import datetime
+import os
+import random
+import sys
+import timeit
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if True:
+    from server.laundry import laundry, safe_division, usage_profiles
+
+
+def synthetic_rows(hall_nos, days, now):
+    """Hourly rows for every hall on every day before now, with four snapshots an hour."""
+    rand = random.Random(0)
+    rows = []
+    for offset in range(days, 0, -1):
+        date = now - datetime.timedelta(days=offset)
+        for hour in range(24):
+            for hall_no in hall_nos:
+                total_washers = rand.randint(2, 12)
+                total_dryers = rand.randint(2, 12)
+                rows.append(
+                    (
+                        hall_no,
+                        date.weekday(),
+                        date,
+                        hour,
+                        sum(rand.randint(0, total_washers) for _ in range(4)),
+                        sum(rand.randint(0, total_dryers) for _ in range(4)),
+                        total_washers * 4,
+                        total_dryers * 4,
+                        4,
+                    )
+                )
+    return rows
+
+
+def loop_profiles(hall_nos, now, rows):
+    """The usage computation before it was vectorized, one row dict at a time."""
+    dow = now.weekday()
+    rows_by_hall = {hall_no: [] for hall_no in hall_nos}
+    for row in rows:
+        if row[1] == dow or row[3] < 3:
+            rows_by_hall[row[0]].append(row)
+
+    profiles = {}
+    for hall_no, hall_rows in rows_by_hall.items():
+        data = [
+            {
+                "date": date,
+                "time": hour,
+                "all_washers": washers / snapshots,
+                "all_dryers": dryers / snapshots,
+                "all_total_washers": total_washers / snapshots,
+                "all_total_dryers": total_dryers / snapshots,
+            }
+            for _, _, date, hour, washers, dryers, total_washers, total_dryers, snapshots in hall_rows
+        ]
+        all_dryers = [int(x["all_total_dryers"]) for x in data]
+        all_washers = [int(x["all_total_washers"]) for x in data]
+        washer_points = {k: 0 for k in range(27)}
+        dryer_points = {k: 0 for k in range(27)}
+        washer_total = {k: 0 for k in range(27)}
+        dryer_total = {k: 0 for k in range(27)}
+        for x in data:
+            hour = int(x["time"])
+            if x["date"].weekday() != now.weekday():
+                hour += 24
+            washer_points[hour] += int(x["all_washers"])
+            dryer_points[hour] += int(x["all_dryers"])
+            washer_total[hour] += 1
+            dryer_total[hour] += 1
+        dates = [x["date"] for x in data]
+        if not dates:
+            dates = [now]
+        profiles[hall_no] = {
+            "hall_name": laundry.id_to_hall[hall_no],
+            "location": laundry.id_to_location[hall_no],
+            "day_of_week": calendar.day_name[now.weekday()],
+            "start_date": min(dates).strftime("%Y-%m-%d"),
+            "end_date": max(dates).strftime("%Y-%m-%d"),
+            "total_number_of_dryers": safe_division(sum(all_dryers), len(all_dryers)),
+            "total_number_of_washers": safe_division(sum(all_washers), len(all_washers)),
+            "washer_data": {x: safe_division(washer_points[x], washer_total[x]) for x in washer_points},
+            "dryer_data": {x: safe_division(dryer_points[x], dryer_total[x]) for x in dryer_points},
+        }
+    return profiles
+
+
+def main():
+    now = datetime.date(2020, 3, 4)
+    hall_nos = sorted(laundry.id_to_hall)
+    tomorrow = (now.weekday() + 1) % 7
+
+    # The usage query only returns rows for today's and tomorrow's day of the week
+    year = [row for row in synthetic_rows(hall_nos, 365, now) if row[1] in (now.weekday(), tomorrow)]
+    month = [row for row in year if row[2] >= now - datetime.timedelta(days=30)]
+
+    print("%-8s %6s %8s %10s %10s %8s" % ("window", "halls", "rows", "loop ms", "numpy ms", "speedup"))
+    for name, rows in [("30 days", month), ("year", year)]:
+        assert usage_profiles(hall_nos, now, rows) == loop_profiles(hall_nos, now, rows)
+        runs = 5
+        loop_ms = min(timeit.repeat(lambda: loop_profiles(hall_nos, now, rows), number=runs, repeat=3)) / runs * 1000
+        numpy_ms = min(timeit.repeat(lambda: usage_profiles(hall_nos, now, rows), number=runs, repeat=3)) / runs * 1000
+        print(
+            "%-8s %6d %8d %10.2f %10.2f %7.1fx"
+            % (name, len(hall_nos), len(rows), loop_ms, numpy_ms, loop_ms / numpy_ms)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+import os
+import sys
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if True:
+    import server
+    import server.analytics
+
+
+# Run once after turning on POST_ANALYTICS_ROLLUP, to roll up the events sent before it
+with server.app.app_context():
+    server.analytics.rebuild_post_analytics()
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+import os
+import sys
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if True:
+    import server
+
+
+# Archives and deletes old laundry snapshots, keeping their hourly totals
+server.laundry.retire_snapshots()
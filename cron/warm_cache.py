@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+import os
+import sys
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if True:
+    import server
+    import server.warmer
+
+
+server.warmer.warm()
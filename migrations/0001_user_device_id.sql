@@ -0,0 +1,4 @@
+-- Bounds user.device_id and indexes it, since every request that identifies a device looks it up.
+-- Device ids sent by the apps are well under 255 characters.
+ALTER TABLE `user` MODIFY device_id VARCHAR(255) NOT NULL;
+CREATE INDEX ix_user_device_id ON `user` (device_id);
@@ -0,0 +1,15 @@
+-- Indexes for the filters on hot paths: laundry usage, preferences, dining balances and
+-- transactions, GSR reminders and lookups, and post analytics.
+CREATE INDEX ix_laundry_snapshot_room_date_time ON laundry_snapshot (room, date, time);
+CREATE INDEX ix_laundry_preference_user_id ON laundry_preference (user_id);
+CREATE INDEX ix_dining_preference_user_id ON dining_preference (user_id);
+CREATE INDEX ix_dining_balance_account_id_created_at ON dining_balance (account_id, created_at);
+CREATE INDEX ix_dining_transaction_account_id_date ON dining_transaction (account_id, date);
+CREATE INDEX ix_analytics_event_type_post_id_is_interaction ON analytics_event (type, post_id, is_interaction);
+
+-- Booking ids and emails were TEXT, which MySQL can't index without a prefix length
+ALTER TABLE study_spaces_booking MODIFY booking_id VARCHAR(255) NULL, MODIFY email VARCHAR(255) NULL;
+CREATE INDEX ix_study_spaces_booking_start_reminder_sent_is_cancelled
+    ON study_spaces_booking (start, reminder_sent, is_cancelled);
+CREATE INDEX ix_study_spaces_booking_booking_id ON study_spaces_booking (booking_id);
+CREATE INDEX ix_study_spaces_booking_email ON study_spaces_booking (email);
@@ -0,0 +1,14 @@
+-- Daily rollups of post analytics events, read by the portal when POST_ANALYTICS_ROLLUP is on.
+CREATE TABLE post_analytics (
+    post_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    interactions INTEGER NOT NULL,
+    impressions INTEGER NOT NULL,
+    PRIMARY KEY (post_id, day)
+);
+CREATE TABLE post_analytics_user (
+    post_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    user INTEGER NOT NULL,
+    PRIMARY KEY (post_id, day, user)
+);
@@ -0,0 +1,14 @@
+-- Hourly laundry usage totals, kept up to date by save_data. After creating the table, fill it in
+-- from the existing snapshots with cron/rebuild_laundry_usage.py.
+CREATE TABLE laundry_usage (
+    room INTEGER NOT NULL,
+    day_of_week INTEGER NOT NULL,
+    date DATE NOT NULL,
+    hour INTEGER NOT NULL,
+    washers INTEGER NOT NULL,
+    dryers INTEGER NOT NULL,
+    total_washers INTEGER NOT NULL,
+    total_dryers INTEGER NOT NULL,
+    snapshots INTEGER NOT NULL,
+    PRIMARY KEY (room, day_of_week, date, hour)
+);
@@ -0,0 +1,8 @@
+-- One laundry snapshot per room per minute. Drop any duplicate minutes saved by overlapping runs
+-- first, then rebuild laundry_usage from what's left with cron/rebuild_laundry_usage.py.
+DELETE s1 FROM laundry_snapshot s1
+    JOIN laundry_snapshot s2 ON s1.date = s2.date AND s1.time = s2.time AND s1.room = s2.room AND s1.id > s2.id;
+ALTER TABLE laundry_snapshot ADD CONSTRAINT uq_laundry_snapshot_date_time_room UNIQUE (date, time, room);
+
+-- The unique constraint's index covers lookups by date
+DROP INDEX ix_laundry_snapshot_date ON laundry_snapshot;
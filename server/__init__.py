@@ -20,11 +20,12 @@ tinify.key = os.environ.get("TINIFY_KEY")
 # sentry
 sentry = Sentry(app)
 
-# AWS S3
+# AWS S3, or any S3-compatible store at AWS_ENDPOINT_URL
 s3 = boto3.client(
     "s3",
     aws_access_key_id=os.environ.get("AWS_KEY"),
     aws_secret_access_key=os.environ.get("AWS_SECRET"),
+    endpoint_url=os.environ.get("AWS_ENDPOINT_URL"),
 )
 
 # allow cors
@@ -51,9 +52,11 @@ import server.event  # noqa
 import server.fitness  # noqa
 import server.homepage  # noqa
 import server.laundry  # noqa
+import server.metrics  # noqa
 import server.news  # noqa
 import server.nso  # noqa
 import server.pcr  # noqa
+import server.query_stats  # noqa
 import server.portal.account  # noqa
 import server.portal.creation  # noqa
 import server.portal.posts  # noqa
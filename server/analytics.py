@@ -1,9 +1,18 @@
 import datetime
+import os
+from collections import Counter
 
 from flask import jsonify, request
+from sqlalchemy import case, func
 
 from server import app, sqldb
-from server.models import Account, AnalyticsEvent, User
+from server.models import Account, AnalyticsEvent, PostAnalytics, PostAnalyticsUser, User, insert_ignore
+
+
+# With this on, post events are also added to the daily rollups in PostAnalytics and PostAnalyticsUser
+# as they are sent, and the portal reads post analytics from those instead of the raw events. Run
+# rebuild_post_analytics once after turning it on, to roll up the events sent before.
+POST_ANALYTICS_ROLLUP = os.environ.get("POST_ANALYTICS_ROLLUP") == "true"
 
 
 @app.route("/feed/analytics", methods=["POST"])
@@ -22,6 +31,7 @@ def send_analytics():
     data = request.get_json()
     events = list(data)
 
+    post_events = []
     for event_json in events:
         timestamp_str = event_json.get("timestamp")
 
@@ -46,6 +56,80 @@ def send_analytics():
             is_interaction=flag,
         )
         sqldb.session.add(event)
+        if type == "post" and post_id is not None:
+            post_events.append(event)
+
+    if POST_ANALYTICS_ROLLUP and post_events:
+        roll_up_post_events(user.id, post_events)
     sqldb.session.commit()
 
     return jsonify({"success": True, "error": None})
+
+
+def roll_up_post_events(user_id, events):
+    """Adds the post events sent by a user to the daily rollups, in the current transaction."""
+    interactions = Counter()
+    impressions = Counter()
+    for event in events:
+        key = (event.post_id, event.timestamp.date())
+        (interactions if event.is_interaction else impressions)[key] += 1
+
+    days = set(interactions) | set(impressions)
+    sqldb.session.execute(
+        insert_ignore(PostAnalytics),
+        [{"post_id": post_id, "day": day, "interactions": 0, "impressions": 0} for post_id, day in days],
+    )
+    table = PostAnalytics.__table__
+    sqldb.session.execute(
+        table.update()
+        .where((table.c.post_id == sqldb.bindparam("key_post_id")) & (table.c.day == sqldb.bindparam("key_day")))
+        .values(
+            interactions=table.c.interactions + sqldb.bindparam("new_interactions"),
+            impressions=table.c.impressions + sqldb.bindparam("new_impressions"),
+        ),
+        [
+            {
+                "key_post_id": post_id,
+                "key_day": day,
+                "new_interactions": interactions[(post_id, day)],
+                "new_impressions": impressions[(post_id, day)],
+            }
+            for post_id, day in days
+        ],
+    )
+    if impressions:
+        sqldb.session.execute(
+            insert_ignore(PostAnalyticsUser),
+            [{"post_id": post_id, "day": day, "user": user_id} for post_id, day in impressions],
+        )
+
+
+def rebuild_post_analytics():
+    """Recomputes the post analytics rollups from every post event sent so far."""
+    day = func.date(AnalyticsEvent.timestamp)
+    is_post = (AnalyticsEvent.type == "post") & AnalyticsEvent.post_id.isnot(None)
+
+    sqldb.session.query(PostAnalytics).delete(synchronize_session=False)
+    sqldb.session.query(PostAnalyticsUser).delete(synchronize_session=False)
+    sqldb.session.execute(
+        PostAnalytics.__table__.insert().from_select(
+            ["post_id", "day", "interactions", "impressions"],
+            sqldb.session.query(
+                AnalyticsEvent.post_id,
+                day,
+                func.sum(case([(AnalyticsEvent.is_interaction, 1)], else_=0)),
+                func.sum(case([(AnalyticsEvent.is_interaction, 0)], else_=1)),
+            )
+            .filter(is_post)
+            .group_by(AnalyticsEvent.post_id, day),
+        )
+    )
+    sqldb.session.execute(
+        PostAnalyticsUser.__table__.insert().from_select(
+            ["post_id", "day", "user"],
+            sqldb.session.query(AnalyticsEvent.post_id, day, AnalyticsEvent.user)
+            .filter(is_post & ~AnalyticsEvent.is_interaction & AnalyticsEvent.user.isnot(None))
+            .distinct(),
+        )
+    )
+    sqldb.session.commit()
@@ -1,15 +1,54 @@
+import hashlib
+import json
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from functools import wraps
 
+import jwt
 import requests
 from flask import g, jsonify, request
+from jwt.algorithms import Algorithm, get_default_algorithms
 from sqlalchemy import or_
+from sqlalchemy.orm import make_transient_to_detached
 
-from server import sqldb
+from server import db, sqldb
+from server.http_client import http
 from server.models import Account, generate_uuid
 
 
+# Introspection results are cached for at most this long, or until the token expires if that's sooner
+INTROSPECTION_TD = timedelta(minutes=10)
+
+# Tokens that platform rejects are remembered for this long
+INVALID_TOKEN_TD = timedelta(seconds=30)
+
+# How many introspection results each process keeps in memory in front of Redis
+INTROSPECTION_CACHE_SIZE = 1024
+
+# If set, signed (JWT) access tokens are verified locally against the keys published here, and only
+# opaque tokens are sent to platform for introspection
+JWKS_URL = os.environ.get("JWKS_URL")
+JWT_ISSUER = os.environ.get("JWT_ISSUER")
+JWT_AUDIENCE = os.environ.get("JWT_AUDIENCE")
+
+# How often the published keys are fetched again, and how soon after a fetch an unknown key id may
+# trigger another one (in case the keys were rotated)
+JWKS_REFRESH = timedelta(hours=1)
+JWKS_MIN_REFRESH = timedelta(minutes=1)
+
+# Only asymmetric algorithms are accepted, so a token can't be signed with a public key. Older
+# versions of PyJWT can't load EC keys from a JWK, so ES* is only accepted where they can
+JWT_ALGORITHMS = [
+    name
+    for name, algorithm in get_default_algorithms().items()
+    if name in ["RS256", "RS384", "RS512", "ES256", "ES384", "ES512"]
+    and type(algorithm).from_jwk is not Algorithm.from_jwk
+]
+
+
 def auth(nullable=False):
     def _auth(f):
         @wraps(f)
@@ -29,16 +68,9 @@ def auth(nullable=False):
                 )
                 if auth_type == "Bearer":  # Only validate if Authorization header type is Bearer
                     try:
-                        body = {"token": token}
-                        headers = {"Authorization": "Bearer {}".format(token)}
-                        data = requests.post(
-                            url="https://platform.pennlabs.org/accounts/introspect/",
-                            headers=headers,
-                            data=body,
-                        )
-                        if data.status_code == 200:  # Access token is valid
-                            data = data.json()
-                            account = Account.query.filter_by(pennid=data["user"]["pennid"]).first()
+                        introspection = introspect(token)
+                        if introspection:  # Access token is valid
+                            account = get_introspected_account(introspection)
                             if account:
                                 g.account = account
                                 return f()
@@ -77,6 +109,189 @@ def auth(nullable=False):
     return _auth
 
 
+class IntrospectionCache(object):
+    """A per-process LRU of introspection results, which expire along with the token."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            introspection = self.entries.get(key)
+            if introspection is None:
+                return None
+            if introspection["expires"] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return introspection
+
+    def put(self, key, introspection):
+        with self.lock:
+            self.entries[key] = introspection
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+introspection_cache = IntrospectionCache(INTROSPECTION_CACHE_SIZE)
+
+
+class KeySet(object):
+    """The public keys access tokens are signed with, as published at a JWKS url.
+
+    The keys are fetched again every refresh, or when a token names a key we don't know about.
+    """
+
+    def __init__(self, refresh, min_refresh):
+        self.refresh = refresh.total_seconds()
+        self.min_refresh = min_refresh.total_seconds()
+        self.keys = {}
+        self.fetched_at = 0
+        self.lock = threading.Lock()
+
+    def get(self, kid):
+        """Returns (algorithm, public key) for kid, or None if there is no such key."""
+        age = time.time() - self.fetched_at
+        if age >= self.refresh or (kid not in self.keys and age >= self.min_refresh):
+            self._fetch()
+        return self.keys.get(kid)
+
+    def _fetch(self):
+        with self.lock:
+            if time.time() - self.fetched_at < self.min_refresh:
+                return
+            try:
+                resp = http.get(JWKS_URL)
+                resp.raise_for_status()
+                jwks = list(resp.json()["keys"])
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                # Keep using the keys we have, if any, until the next try
+                if not self.keys:
+                    raise requests.exceptions.RequestException("Couldn't fetch keys from %s: %s" % (JWKS_URL, e))
+                self.fetched_at = time.time() - self.refresh + self.min_refresh
+                return
+            algorithms = get_default_algorithms()
+            keys = {}
+            for jwk in jwks:
+                try:
+                    if jwk.get("alg") in JWT_ALGORITHMS:
+                        keys[jwk.get("kid")] = (jwk["alg"], algorithms[jwk["alg"]].from_jwk(json.dumps(jwk)))
+                except Exception:
+                    # A key we can't load can't have signed a token we accept, so it is skipped
+                    continue
+            self.keys = keys
+            self.fetched_at = time.time()
+
+
+key_set = KeySet(JWKS_REFRESH, JWKS_MIN_REFRESH)
+
+
+def introspect(token):
+    """Asks platform about token, returning {"pennid": ..., "account": ...} if it's valid and None if not.
+
+    Signed tokens are verified locally instead if JWKS_URL is set. Results are cached in this
+    process and in Redis (keyed by a hash of the token, so tokens aren't stored anywhere), so
+    platform is only asked about each token once in a while. "account" is the
+    id of the matching Account, or None if there wasn't one yet.
+    """
+    key = "auth:token:%s" % hashlib.sha256(token.encode("utf8")).hexdigest()
+    introspection = introspection_cache.get(key)
+    if introspection is None:
+        value = db.get(key)
+        if value is not None:
+            introspection = json.loads(value.decode("utf8"))
+        else:
+            # Signed tokens can be checked here, but opaque ones only mean something to platform
+            if JWKS_URL and token.count(".") == 2:
+                introspection = _verify(token)
+            else:
+                introspection = _introspect(token)
+            _store_introspection(key, introspection)
+        introspection_cache.put(key, introspection)
+    if not introspection["valid"]:
+        return None
+    if introspection["account"] is None:
+        # Accounts are created after the user first logs in, so look again until there is one
+        account = Account.query.with_entities(Account.id).filter_by(pennid=introspection["pennid"]).first()
+        if account:
+            introspection = dict(introspection, account=account.id)
+            introspection_cache.put(key, introspection)
+            _store_introspection(key, introspection)
+    return introspection
+
+
+def _store_introspection(key, introspection):
+    ttl = int((introspection["expires"] - time.time()) * 1000)
+    if ttl > 0:
+        db.set(key, json.dumps(introspection), px=ttl)
+
+
+def _introspect(token):
+    body = {"token": token}
+    headers = {"Authorization": "Bearer {}".format(token)}
+    data = http.post(
+        url="https://platform.pennlabs.org/accounts/introspect/", headers=headers, data=body
+    )
+    if data.status_code == 429 or data.status_code >= 500:
+        # Platform couldn't answer, which says nothing about the token, so don't remember it
+        raise requests.exceptions.HTTPError("Platform returned %d" % data.status_code, response=data)
+    if data.status_code != 200:
+        return _invalid_introspection()
+    data = data.json()
+    return _valid_introspection(data["user"]["pennid"], data.get("exp"))
+
+
+def _verify(token):
+    """Checks the signature and claims of a JWT access token against the published keys."""
+    try:
+        header = jwt.get_unverified_header(token)
+        key = key_set.get(header.get("kid"))
+        if key is None or header.get("alg") != key[0]:
+            return _invalid_introspection()
+        claims = jwt.decode(
+            token,
+            key[1],
+            algorithms=[key[0]],
+            issuer=JWT_ISSUER,
+            audience=JWT_AUDIENCE,
+            options={"verify_aud": bool(JWT_AUDIENCE)},
+        )
+    except jwt.InvalidTokenError:
+        return _invalid_introspection()
+    # exp is checked by decode when it's there, but tokens without one are rejected too
+    if "pennid" not in claims or not isinstance(claims.get("exp"), (int, float)):
+        return _invalid_introspection()
+    return _valid_introspection(claims["pennid"], claims["exp"])
+
+
+def _valid_introspection(pennid, exp=None):
+    expires = time.time() + INTROSPECTION_TD.total_seconds()
+    if exp:
+        expires = min(expires, exp)
+    account = Account.query.with_entities(Account.id).filter_by(pennid=pennid).first()
+    return {"valid": True, "expires": expires, "pennid": pennid, "account": account.id if account else None}
+
+
+def _invalid_introspection():
+    return {"valid": False, "expires": time.time() + INVALID_TOKEN_TD.total_seconds()}
+
+
+def get_introspected_account(introspection):
+    """Returns the Account for an introspected token, without querying for it.
+
+    Only the account's id and pennid are known up front, and its other columns are loaded the first
+    time they are used.
+    """
+    if introspection["account"] is None:
+        return None
+    account = Account(id=introspection["account"], pennid=introspection["pennid"])
+    make_transient_to_detached(account)
+    return sqldb.session.merge(account, load=False)
+
+
 def internal_auth(f):
     @wraps(f)
     def _internal_auth(*args, **kwargs):
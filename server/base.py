@@ -1,22 +1,514 @@
 import datetime
+import functools
+import gzip
+import hashlib
 import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import jsonify, make_response
+from flask import request
 
-from server import db
+from server import app, db, sentry
+from server.metrics import metrics
 
 
-def cached_route(redis_key, td, func):
-    data = cache_get(redis_key, td, func)
-    secs = int(db.ttl(redis_key))
-    return make_response(jsonify(data), 200, {"Cache-Control": "max-age=%d" % secs})
+# How long a caller may hold the recompute lock for a key before it is considered dead
+LOCK_TIMEOUT = datetime.timedelta(seconds=30)
 
+# How long callers that lose the race for the lock wait for the winner before giving up
+LOCK_WAIT = datetime.timedelta(seconds=5)
+LOCK_POLL_INTERVAL = 0.05
 
-def cache_get(redis_key, td, func):
-    if db.exists(redis_key):
-        return json.loads(db.get(redis_key).decode("utf8"))
+# Cache entries start with this byte, followed by a line of JSON metadata and then the JSON value.
+# Entries without it are plain JSON values written before the metadata existed.
+ENTRY_HEADER = b"\x01"
+
+# cached_route only gzips bodies at least this big
+GZIP_MIN_BYTES = 1024
+
+# With compress, values at least this big are stored gzipped in Redis (see benchmarks/cache_codec.py)
+COMPRESS_MIN_BYTES = 16 * 1024
+GZIP_LEVEL = 6
+
+# Stale values are refreshed off the request thread by this pool
+refresh_executor = ThreadPoolExecutor(max_workers=2)
+
+# Upper bound on the (encoded) size of the values each process keeps in memory in front of Redis
+LOCAL_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Every write to a cache key is announced on this channel, so processes can drop their local copy
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Stores a freshly computed value, but only if the lock is still ours (or has lapsed and nobody
+# else has taken it), so a caller whose lock expired mid-recompute can't clobber a newer value.
+# KEYS: value key, lock key. ARGV: lock token, value, expiry as a unix timestamp in milliseconds,
+# invalidation channel, invalidation message.
+_set_if_lock_owner = db.register_script(
+    """
+    local owner = redis.call("get", KEYS[2])
+    if owner == ARGV[1] or not owner then
+        redis.call("set", KEYS[1], ARGV[2])
+        redis.call("pexpireat", KEYS[1], ARGV[3])
+        redis.call("publish", ARGV[4], ARGV[5])
+    end
+    if owner == ARGV[1] then
+        redis.call("del", KEYS[2])
+    end
+    """
+)
+
+# Releases a lock without storing anything, if it is still ours. KEYS: lock key. ARGV: lock token.
+_release_lock = db.register_script(
+    """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+)
+
+
+class LocalCache(object):
+    """A per-process, size-bounded LRU of cache entries.
+
+    Entries are only served while they are fresh and while this process is subscribed to
+    INVALIDATION_CHANNEL, so a value overwritten in Redis by any process is never served from here.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.listener_pid = None
+        self.listening = False
+        # Bumped on every invalidation, so a value read from Redis before an invalidation arrived
+        # isn't stored afterwards
+        self.generation = 0
+
+    def get(self, key):
+        """Returns the CacheEntry for key if this process has a fresh copy of it, else None."""
+        self._ensure_listener()
+        with self.lock:
+            if not self.listening or key not in self.entries:
+                return None
+            entry = self.entries[key]
+            if entry.meta.get("fresh_until", entry.meta["expires"]) <= time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry, generation):
+        """Stores a copy of key that was read or written when self.generation was generation."""
+        if "expires" not in entry.meta or entry.size > self.max_bytes:
+            return
+        with self.lock:
+            if not self.listening or generation != self.generation:
+                return
+            self._remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generation += 1
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= entry.size
+
+    def _ensure_listener(self):
+        # uWSGI forks workers after import, so each process needs its own listener thread
+        if self.listener_pid == os.getpid():
+            return
+        with self.lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.listener_pid = os.getpid()
+            self.listening = False
+            self.entries.clear()
+            self.size = 0
+        thread = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+        thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = db.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything cached before we (re)subscribed may have missed an invalidation
+                self.clear()
+                self.listening = True
+                for message in pubsub.listen():
+                    origin, _, key = message["data"].decode("utf8").partition(" ")
+                    if origin != _process_origin():
+                        self.invalidate(key)
+            except Exception:
+                self.listening = False
+                self.clear()
+                time.sleep(1)
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_BYTES)
+
+
+class CacheEntry(object):
+    """A cached value as stored in Redis: its metadata plus its JSON-encoded body.
+
+    The body is stored gzipped if meta["encoding"] is "gzip". It is only decompressed and decoded
+    when asked for, so routes can send it to clients as is.
+    """
+
+    def __init__(self, meta, body=None, data=None, decoded=False, gzipped=None):
+        self.meta = meta
+        self._body = body
+        self._data = data
+        self._decoded = decoded
+        self._gzipped = gzipped
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = gzip.decompress(self._gzipped)
+        return self._body
+
+    @property
+    def compressed(self):
+        return self.meta.get("encoding") == "gzip"
+
+    @property
+    def size(self):
+        """The size of the body as stored in Redis."""
+        return len(self._stored_body())
+
+    @property
+    def data(self):
+        if not self._decoded:
+            self._data = json.loads(self.body.decode("utf8"))
+            self._decoded = True
+        return self._data
+
+    @property
+    def etag(self):
+        """A hash of the body, stored when the value was cached (or computed for older entries)."""
+        if "etag" not in self.meta:
+            self.meta["etag"] = hashlib.sha1(self.body).hexdigest()
+        return self.meta["etag"]
+
+    def gzipped(self):
+        """Returns the body gzip-compressed, compressing it only the first time."""
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self._body, GZIP_LEVEL)
+        return self._gzipped
+
+    @staticmethod
+    def create(data, td, soft_td=None, compress=False):
+        now = time.time()
+        meta = {"expires": now + td.total_seconds()}
+        if soft_td is not None:
+            meta["fresh_until"] = now + soft_td.total_seconds()
+        body = json.dumps(data, separators=(",", ":")).encode("utf8")
+        meta["etag"] = hashlib.sha1(body).hexdigest()
+        if compress and len(body) >= COMPRESS_MIN_BYTES:
+            meta["encoding"] = "gzip"
+        return CacheEntry(meta, body, data, decoded=True)
+
+    @staticmethod
+    def parse(value):
+        if not value.startswith(ENTRY_HEADER):
+            return CacheEntry({}, value)
+        meta, _, body = value[len(ENTRY_HEADER):].partition(b"\n")
+        meta = json.loads(meta.decode("utf8"))
+        if meta.get("encoding") == "gzip":
+            return CacheEntry(meta, gzipped=body)
+        return CacheEntry(meta, body)
+
+    def serialize(self):
+        return ENTRY_HEADER + json.dumps(self.meta).encode("utf8") + b"\n" + self._stored_body()
+
+    def _stored_body(self):
+        return self.gzipped() if self.compressed else self._body
+
+    def is_stale(self):
+        return bool(self.meta.get("fresh_until")) and self.meta["fresh_until"] <= time.time()
+
+
+def cache_invalidate(redis_key):
+    """Removes redis_key from Redis and from every process's local cache."""
+    db.delete(redis_key)
+    db.publish(INVALIDATION_CHANNEL, _invalidation_message(redis_key))
+    local_cache.invalidate(redis_key)
+
+
+def cached_route(redis_key, td, func, soft_td=None, compress=False):
+    """Responds with the JSON value cached at redis_key (see cache_get).
+
+    The cached body is sent as is, without decoding and re-encoding it, and gzipped if the client
+    accepts it. Responses carry an ETag, and conditional requests for an unchanged value are
+    answered with a bodiless 304.
+    """
+    entry = _cache_get(redis_key, td, func, soft_td=soft_td, local=True, compress=compress)
+    return entry_response(entry, redis_key)
+
+
+def entry_response(entry, redis_key=None):
+    """Responds with the body of a CacheEntry, with the same caching headers as cached_route."""
+    # Clients shouldn't hold on to a value longer than we consider it fresh
+    expires = entry.meta.get("fresh_until") or entry.meta.get("expires")
+    secs = int(expires - time.time()) if expires else int(db.ttl(redis_key))
+    headers = {"Cache-Control": "max-age=%d" % max(secs, 0), "Vary": "Accept-Encoding"}
+
+    # Weak, since the gzipped and plain bodies share one ETag
+    if request.if_none_match.contains_weak(entry.etag):
+        response = app.response_class(status=304, headers=headers)
+        response.set_etag(entry.etag, weak=True)
+        return response
+
+    # Values stored gzipped are sent to clients exactly as they are stored
+    if "gzip" in request.accept_encodings and (entry.compressed or len(entry.body) >= GZIP_MIN_BYTES):
+        body = entry.gzipped()
+        headers["Content-Encoding"] = "gzip"
     else:
-        data = func()
-        db.set(redis_key, json.dumps(data))
-        db.pexpireat(redis_key, datetime.datetime.now() + td)
-        return data
+        body = entry.body
+    response = app.response_class(body, status=200, headers=headers, mimetype="application/json")
+    response.set_etag(entry.etag, weak=True)
+    return response
+
+
+def cache_get(redis_key, td, func, single_flight=True, soft_td=None, local=False, compress=False):
+    """Returns the value cached at redis_key, calling func to compute and cache it for td on a miss.
+
+    With single_flight, only one caller across all processes recomputes a missing key at a time.
+    The others wait up to LOCK_WAIT for that value to show up, and only call func themselves if
+    it doesn't.
+
+    With soft_td, a value older than soft_td (but younger than td) is still returned right away,
+    and is recomputed in the background for the next caller.
+
+    With local, fresh values are also kept decoded in this process's memory, and later calls are
+    answered without going to Redis at all. The same object is then handed to every caller, so
+    callers must not modify it.
+
+    With compress, large values are stored gzipped in Redis, trading some CPU for memory and
+    network. This pays off for big values that are read far more often than they are written.
+    """
+    return _cache_get(redis_key, td, func, single_flight, soft_td, local, compress).data
+
+
+def cache_get_many(redis_keys, td, loader, soft_td=None, compress=False):
+    """Returns a dict with the value cached at each of redis_keys, like cache_get does for one key.
+
+    All keys are read with a single MGET. loader is called once with the list of keys that
+    missed, and returns a dict with their values; those are then cached for td with a single
+    pipeline. Keys the loader leaves out aren't cached, and are left out of the result too. Stale
+    keys (see soft_td) are refreshed in the background one by one.
+    """
+    redis_keys = list(redis_keys)
+    if not redis_keys:
+        return {}
+
+    values = {}
+    missing = []
+    for redis_key, value in zip(redis_keys, db.mget(redis_keys)):
+        if value is None:
+            if redis_key not in missing:
+                missing.append(redis_key)
+                metrics.incr("cache_misses_total", {"namespace": _namespace(redis_key)})
+            continue
+        entry = CacheEntry.parse(value)
+        _record_hit(redis_key, "redis", entry)
+        if entry.is_stale():
+            _refresh_in_background(
+                redis_key, td, functools.partial(_load_one, loader, redis_key), soft_td, compress
+            )
+        values[redis_key] = entry.data
+
+    if missing:
+        loaded = _load(missing[0], functools.partial(loader, missing))
+        pipe = db.pipeline(transaction=False)
+        for redis_key in missing:
+            if redis_key not in loaded:
+                continue
+            entry = CacheEntry.create(loaded[redis_key], td, soft_td, compress)
+            _record_size(redis_key, entry)
+            pipe.set(redis_key, entry.serialize())
+            pipe.pexpireat(redis_key, int(entry.meta["expires"] * 1000))
+            pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(redis_key))
+            values[redis_key] = loaded[redis_key]
+        pipe.execute()
+    return values
+
+
+def cache_refresh(redis_key, td, func, soft_td=None, compress=False):
+    """Recomputes and stores the value at redis_key, unless someone else is already doing so.
+
+    Returns whether the value was refreshed.
+    """
+    lock_key, token = _acquire_lock(redis_key)
+    if not token:
+        return False
+    try:
+        data = _load(redis_key, func)
+    except Exception:
+        _release_lock(keys=[lock_key], args=[token])
+        raise
+    _store(redis_key, lock_key, token, CacheEntry.create(data, td, soft_td, compress))
+    return True
+
+
+def _load_one(loader, redis_key):
+    return loader([redis_key])[redis_key]
+
+
+def _cache_get(redis_key, td, func, single_flight=True, soft_td=None, local=False, compress=False):
+    """Same as cache_get, but returns the CacheEntry."""
+    if local:
+        entry = local_cache.get(redis_key)
+        if entry:
+            _record_hit(redis_key, "local", entry)
+            return entry
+        generation = local_cache.generation
+
+    value = db.get(redis_key)
+    if value is not None:
+        entry = CacheEntry.parse(value)
+        _record_hit(redis_key, "redis", entry)
+        if entry.is_stale():
+            _refresh_in_background(redis_key, td, func, soft_td, compress)
+        elif local:
+            local_cache.put(redis_key, entry, generation)
+        return entry
+
+    metrics.incr("cache_misses_total", {"namespace": _namespace(redis_key)})
+    if not single_flight:
+        entry = CacheEntry.create(_load(redis_key, func), td, soft_td, compress)
+        _record_size(redis_key, entry)
+        db.set(redis_key, entry.serialize())
+        db.pexpireat(redis_key, int(entry.meta["expires"] * 1000))
+        db.publish(INVALIDATION_CHANNEL, _invalidation_message(redis_key))
+        if local:
+            local_cache.put(redis_key, entry, generation)
+        return entry
+
+    lock_key, token = _acquire_lock(redis_key)
+    if not token:
+        deadline = time.time() + LOCK_WAIT.total_seconds()
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            lock_held = db.exists(lock_key)
+            value = db.get(redis_key)
+            if value is not None:
+                return CacheEntry.parse(value)
+            if not lock_held:
+                break
+        # The lock holder is slow or died without storing anything, so compute the value here,
+        # without stepping on the lock if it is still held
+
+    try:
+        data = _load(redis_key, func)
+    except Exception:
+        if token:
+            _release_lock(keys=[lock_key], args=[token])
+        raise
+
+    entry = CacheEntry.create(data, td, soft_td, compress)
+    _store(redis_key, lock_key, token, entry)
+    if local:
+        local_cache.put(redis_key, entry, generation)
+    return entry
+
+
+def _store(redis_key, lock_key, token, entry):
+    _record_size(redis_key, entry)
+    _set_if_lock_owner(
+        keys=[redis_key, lock_key],
+        args=[
+            token or "",
+            entry.serialize(),
+            int(entry.meta["expires"] * 1000),
+            INVALIDATION_CHANNEL,
+            _invalidation_message(redis_key),
+        ],
+    )
+
+
+def _namespace(redis_key):
+    """The part of redis_key before the first colon, which metrics are grouped by."""
+    return redis_key.partition(":")[0]
+
+
+def _load(redis_key, func):
+    """Calls func, recording how long it took and whether it raised."""
+    labels = {"namespace": _namespace(redis_key)}
+    start = time.time()
+    try:
+        return func()
+    except Exception:
+        metrics.incr("cache_errors_total", labels)
+        raise
+    finally:
+        metrics.observe("cache_load_seconds", labels, time.time() - start)
+
+
+def _record_hit(redis_key, tier, entry):
+    labels = {"namespace": _namespace(redis_key)}
+    metrics.incr("cache_hits_total", dict(labels, tier=tier))
+    if entry.is_stale():
+        metrics.incr("cache_stale_hits_total", labels)
+
+
+def _record_size(redis_key, entry):
+    metrics.observe("cache_value_bytes", {"namespace": _namespace(redis_key)}, entry.size)
+
+
+def _process_origin():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def _invalidation_message(redis_key):
+    # Tagged with this process, which doesn't need to drop the copy it just stored
+    return "%s %s" % (_process_origin(), redis_key)
+
+
+def _acquire_lock(redis_key):
+    """Tries to take the recompute lock for redis_key, returning (lock key, token or None)."""
+    lock_key = "lock:%s" % redis_key
+    token = str(uuid.uuid4())
+    if db.set(lock_key, token, nx=True, px=int(LOCK_TIMEOUT.total_seconds() * 1000)):
+        return lock_key, token
+    return lock_key, None
+
+
+def _refresh_in_background(redis_key, td, func, soft_td, compress):
+    # Take the lock here so that only one refresh per key is ever queued
+    lock_key, token = _acquire_lock(redis_key)
+    if not token:
+        return
+
+    def refresh():
+        try:
+            with app.app_context():
+                data = _load(redis_key, func)
+        except Exception:
+            _release_lock(keys=[lock_key], args=[token])
+            sentry.captureException()
+            return
+        _store(redis_key, lock_key, token, CacheEntry.create(data, td, soft_td, compress))
+
+    refresh_executor.submit(refresh)
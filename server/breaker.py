@@ -0,0 +1,102 @@
+import datetime
+import hashlib
+import re
+import time
+
+from penn.base import APIError
+from requests.exceptions import RequestException
+
+from server import db
+from server.metrics import metrics
+
+
+# An upstream that fails this many times within FAILURE_WINDOW is considered down
+FAILURE_THRESHOLD = 5
+FAILURE_WINDOW = datetime.timedelta(minutes=1)
+
+# How long calls to a down upstream fail right away before it is tried again
+OPEN_TIMEOUT = datetime.timedelta(seconds=30)
+
+# How long a failed call is remembered, so the same call fails right away if it is made again
+NEGATIVE_TTL = datetime.timedelta(seconds=15)
+
+# The message of the APIError PennSDK raises for a response that isn't a 200
+STATUS_ERROR = re.compile(r"^Request to .* returned (\d+)$")
+
+
+def upstream_failure(error):
+    """Whether error means the upstream is unhealthy: it couldn't be reached, or it answered with a
+    5xx. APIErrors for bad parameters, or for an error_text in a successful response, don't count.
+    """
+    if isinstance(error, RequestException):
+        return True
+    match = STATUS_ERROR.match(str(error)) if isinstance(error, APIError) else None
+    return match is not None and int(match.group(1)) >= 500
+
+
+class CircuitBreaker(object):
+    """Wraps an upstream client, failing fast while the upstream is down.
+
+    Calls that raise an exception for which failures(exception) is true count against the upstream.
+    Once it has failed FAILURE_THRESHOLD times within FAILURE_WINDOW, every call raises error right
+    away for OPEN_TIMEOUT. After that, calls go through again, but a single failure reopens the breaker.
+    Each failed call is also remembered for NEGATIVE_TTL, and repeats of it raise error without
+    waiting on the upstream.
+
+    The breaker state lives in Redis, so every process stops calling an upstream once it is down.
+    Methods named in local don't talk to the upstream, and are passed through untouched.
+    """
+
+    def __init__(self, client, name, error, failures=upstream_failure, local=()):
+        self.client = client
+        self.name = name
+        self.error = error
+        self.failures = failures
+        self.local = set(local)
+        self.open_key = "breaker:%s:open" % name
+        self.failures_key = "breaker:%s:failures" % name
+
+    def __getattr__(self, attr):
+        value = getattr(self.client, attr)
+        if attr.startswith("_") or attr in self.local or not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            return self.call(attr, value, *args, **kwargs)
+
+        return call
+
+    def call(self, name, func, *args, **kwargs):
+        negative_key = "breaker:%s:error:%s" % (
+            self.name,
+            hashlib.sha1(repr((name, args, sorted(kwargs.items()))).encode("utf8")).hexdigest(),
+        )
+        open_until, failures, cached_error = db.mget([self.open_key, self.failures_key, negative_key])
+        if open_until is not None or cached_error is not None:
+            metrics.incr("upstream_short_circuits_total", {"upstream": self.name})
+            raise self.error("The %s api is currently unavailable." % self.name)
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.failures(e):
+                self._record_failure(negative_key)
+            raise
+        if failures is not None:
+            db.delete(self.failures_key)
+        return result
+
+    def _record_failure(self, negative_key):
+        metrics.incr("upstream_errors_total", {"upstream": self.name})
+        pipe = db.pipeline(transaction=False)
+        pipe.set(negative_key, 1, px=int(NEGATIVE_TTL.total_seconds() * 1000))
+        pipe.incr(self.failures_key)
+        pipe.pexpire(self.failures_key, int(FAILURE_WINDOW.total_seconds() * 1000))
+        failures = pipe.execute()[1]
+        if failures >= FAILURE_THRESHOLD:
+            open_until = time.time() + OPEN_TIMEOUT.total_seconds()
+            pipe = db.pipeline(transaction=False)
+            pipe.set(self.open_key, open_until, px=int(OPEN_TIMEOUT.total_seconds() * 1000))
+            # One more failure once the breaker closes again is enough to reopen it
+            pipe.set(self.failures_key, FAILURE_THRESHOLD - 1, px=int(FAILURE_WINDOW.total_seconds() * 1000))
+            pipe.execute()
@@ -15,7 +15,9 @@ def pull_calendar(d):
 
     :param d: date object that specifies the date
     """
-    pulled_calendar = cache_get("calendar:3year", datetime.timedelta(weeks=1), calendar.pull_3year)
+    pulled_calendar = cache_get(
+        "calendar:3year", datetime.timedelta(weeks=1), calendar.pull_3year, compress=True
+    )
     within_range = []
     for event in pulled_calendar:
         start = event["end"]
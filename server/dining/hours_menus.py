@@ -1,7 +1,7 @@
 import datetime
 
 from server import app, db
-from server.base import cached_route
+from server.base import CacheEntry, cache_get_many, cached_route, entry_response
 from server.penndata import din, dinV2
 
 
@@ -18,23 +18,60 @@ def retrieve_venues_v2():
 @app.route("/dining/v2/menu/<venue_id>/<date>", methods=["GET"])
 def retrieve_menu_v2(venue_id, date):
     def get_data():
-        return dinV2.menu(venue_id, date)["result_data"]
+        return get_menu_v2(venue_id, date)
 
     # Cache the result for 24 hours
     td = datetime.timedelta(days=1)
-    return cached_route("dining:v2:menu:%s:%s" % (venue_id, date), td, get_data)
+    return cached_route(menu_v2_key(venue_id, date), td, get_data)
+
+
+def get_menu_v2(venue_id, date):
+    return dinV2.menu(venue_id, date)["result_data"]
+
+
+def menu_v2_key(venue_id, date):
+    return "dining:v2:menu:%s:%s" % (venue_id, date)
 
 
 @app.route("/dining/v2/item/<item_id>", methods=["GET"])
 def retrieve_item_v2(item_id):
+    # Cache the result for 24 hours
+    td = datetime.timedelta(days=1)
+
+    # Several comma-separated items are cached one by one, and sent like the upstream sends them,
+    # leaving out the items it doesn't have
+    if "," in item_id:
+        items = retrieve_items_v2(item_id.split(","))
+        data = {"items": {x: item for x, item in items.items() if item is not None}}
+        return entry_response(CacheEntry.create(data, td))
+
     def get_data():
         return dinV2.item(item_id)["result_data"]
 
-    # Cache the result for 24 hours
-    td = datetime.timedelta(days=1)
     return cached_route("dining:v2:item:%s" % item_id, td, get_data)
 
 
+def retrieve_items_v2(item_ids):
+    """Returns a dict of item id to item, fetching all uncached items in one request.
+
+    Items the upstream doesn't return are None, and aren't cached, so they are asked for again next time.
+    """
+    # These keys hold a single item, while the single item route caches the whole result_data under
+    # dining:v2:item:, so the two can't share keys
+    item_keys = {item_id: "dining:v2:items:%s" % item_id for item_id in item_ids}
+    key_to_item = {key: item_id for item_id, key in item_keys.items()}
+
+    def get_data(keys):
+        ids = [key_to_item[key] for key in keys]
+        items = dinV2.item(",".join(ids))["result_data"]["items"]
+        return {item_keys[x]: items[x] for x in ids if x in items}
+
+    # Cache the results for 24 hours
+    td = datetime.timedelta(days=1)
+    items = cache_get_many(item_keys.values(), td, get_data)
+    return {item_id: items.get(key) for item_id, key in item_keys.items()}
+
+
 @app.route("/dining/venues", methods=["GET"])
 def retrieve_venues():
     def get_data():
@@ -43,7 +80,9 @@ def retrieve_venues():
 
         json = din.venues()["result_data"]
         venues = json["document"]["venue"]
-        for venue in venues:
+        # Look up every venue's image at once
+        image_urls = db.mget(["venue:%s" % (str(venue["id"])) for venue in venues]) if venues else []
+        for venue, imageUrlJSON in zip(venues, image_urls):
             days = venue.get("dateHours")
             if days:
                 for day in days:
@@ -62,7 +101,6 @@ def retrieve_venues():
                     new_meals.sort(key=sortByStart)
                     day["meal"] = new_meals
 
-            imageUrlJSON = db.get("venue:%s" % (str(venue["id"])))
             if imageUrlJSON:
                 venue["imageURL"] = imageUrlJSON.decode("utf8").replace('"', "")
             else:
@@ -70,9 +108,11 @@ def retrieve_venues():
         return json
 
     # Cache the result for 24 hours
-    # TEMPORARILY CHANGED CACHE TO 15 MINUTES WHILE BON APPETIT WORKS TO FIX API
-    td = datetime.timedelta(minutes=15)
-    return cached_route("dining:venues", td, get_data)
+    # TEMPORARILY REFRESH EVERY 15 MINUTES WHILE BON APPETIT WORKS TO FIX API
+    # (older values are still served while they are refreshed in the background)
+    td = datetime.timedelta(days=1)
+    soft_td = datetime.timedelta(minutes=15)
+    return cached_route("dining:venues", td, get_data, soft_td=soft_td, compress=True)
 
 
 @app.route("/dining/hours/<venue_id>", methods=["GET"])
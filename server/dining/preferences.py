@@ -36,7 +36,7 @@ def save_dining_preferences():
 @app.route("/dining/preferences", methods=["GET"])
 def get_dining_preferences():
     try:
-        user = User.get_or_create()
+        user = User.get_user()
     except ValueError:
         return jsonify({"preferences": []})
 
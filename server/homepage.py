@@ -10,6 +10,7 @@ from server.account.courses import get_courses_in_N_days, get_todays_courses
 from server.auth import auth
 from server.base import cache_get
 from server.calendar3year import pull_todays_calendar
+from server.http_client import http
 from server.models import Account, DiningPreference, HomeCell, LaundryPreference, User
 from server.news import fetch_frontpage_article
 from server.portal.posts import get_posts_for_account
@@ -256,7 +257,7 @@ def get_post_cells(account):
 
 def get_current_version():
     def get_data():
-        r = requests.get(url="http://itunes.apple.com/lookup?bundleId=org.pennlabs.PennMobile")
+        r = http.get(url="http://itunes.apple.com/lookup?bundleId=org.pennlabs.PennMobile")
         json = r.json()
         version = json["results"][0]["version"]
         return version
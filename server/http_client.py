@@ -0,0 +1,94 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# (connect, read) timeout in seconds for calls that don't pass their own
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# How many connections each process keeps open to a host. Every process serves two request threads
+# and runs two background cache refreshes, so that's what most hosts need.
+DEFAULT_POOL_SIZE = 4
+
+# Hosts that are called concurrently from a single request (see the laundry fan-out)
+POOL_SIZES = {"suds.kite.upenn.edu": 8, "platform.pennlabs.org": 4}
+
+# Connections that fail to open are retried, as are idempotent requests the upstream answers with a
+# gateway error. Requests that were sent but timed out waiting for a response are not.
+RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=1,
+    backoff_factor=0.1,
+    status_forcelist=(502, 503, 504),
+    raise_on_status=False,
+    # urllib3 1.26 renamed method_whitelist to allowed_methods, and 2.0 dropped the old name
+    **(
+        {"allowed_methods": Retry.DEFAULT_ALLOWED_METHODS}
+        if hasattr(Retry, "DEFAULT_ALLOWED_METHODS")
+        else {"method_whitelist": Retry.DEFAULT_METHOD_WHITELIST}
+    )
+)
+
+
+class PooledRequests(object):
+    """A drop-in for the requests module whose calls share keep-alive connection pools.
+
+    Each process gets its own requests.Session (uWSGI forks workers after import, and sockets
+    can't be shared across the fork), with one pool per host. The session is shared by every user,
+    so it never keeps cookies; callers that need them pass them with each request. Anything other than the request
+    methods, like requests.exceptions, is passed through to the requests module.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self._session = None
+
+    @property
+    def session(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self._session = _create_session()
+                    self.pid = os.getpid()
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("GET", url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request("PUT", url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(requests, attr)
+
+
+def _create_session():
+    session = requests.Session()
+    # Cookies set by one user's upstream session (like Wharton's) must not be sent on another's
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    for scheme in ["http://", "https://"]:
+        session.mount(scheme, HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE, max_retries=RETRY))
+        for host, size in POOL_SIZES.items():
+            session.mount(scheme + host, HTTPAdapter(pool_maxsize=size, max_retries=RETRY))
+    return session
+
+
+http = PooledRequests()
@@ -1,22 +1,53 @@
 import calendar
+import csv
 import datetime
+import gzip
+import io
+import os
+import time
+from concurrent import futures
 
+import numpy as np
 from flask import g, jsonify, request
 from pytz import timezone
 from requests.exceptions import HTTPError
-from sqlalchemy import Integer, cast, exists, func
+from sqlalchemy import Integer, cast, func
 
-from server import app, sqldb
+from server import app, db, laundry_snapshot, query_stats, s3, sqldb
 from server.auth import auth
-from server.base import cached_route
-from server.models import LaundryPreference, LaundrySnapshot, User
+from server.base import cache_get_many, cached_route
+from server.models import LaundryPreference, LaundrySnapshot, LaundryUsage, User, insert_ignore
 from server.penndata import laundry
 
 
+# Usage data is recomputed every 15 minutes, but older data is still served while it is
+USAGE_TD = datetime.timedelta(days=1)
+USAGE_SOFT_TD = datetime.timedelta(minutes=15)
+
+# Endpoints covering several halls scrape them concurrently on this pool, which is sized to match
+# the connection pool for the laundry site (see server/http_client.py)
+fanout_executor = futures.ThreadPoolExecutor(max_workers=8)
+
+# How long those endpoints wait for every hall before giving up
+FANOUT_DEADLINE = datetime.timedelta(seconds=10)
+
+# The version of the last laundry snapshot save_data saved
+SAVED_VERSION_KEY = "laundry:snapshot:saved_version"
+
+# Snapshots are kept this long. Older days are archived and deleted, leaving their hourly totals in LaundryUsage
+SNAPSHOT_RETENTION = datetime.timedelta(days=int(os.environ.get("LAUNDRY_SNAPSHOT_RETENTION_DAYS", 35)))
+
+# Where retired snapshots are archived: a local directory, or s3://bucket/prefix in a private bucket
+SNAPSHOT_ARCHIVE = os.environ.get("LAUNDRY_SNAPSHOT_ARCHIVE")
+
+# Retired snapshots are deleted this many at a time, so no one statement holds locks for long
+SNAPSHOT_DELETE_BATCH = 5000
+
+
 @app.route("/laundry/halls", methods=["GET"])
 def all_halls():
     try:
-        return jsonify({"halls": laundry.all_status()})
+        return jsonify({"halls": laundry_snapshot.all_status()})
     except HTTPError:
         return jsonify({"error": "The laundry api is currently unavailable."})
 
@@ -26,19 +57,24 @@ def get_rooms(hall_ids):
     est = timezone("EST")
     date = datetime.datetime.now(est)
     halls = [int(x) for x in hall_ids.split(",")]
-    output = {"rooms": []}
-    for hall in halls:
-        hall_data = laundry.hall_status(hall)
-        hall_data["id"] = hall
-        hall_data["usage_data"] = usage_data(hall, date.year, date.month, date.day)
-        output["rooms"].append(hall_data)
+
+    try:
+        usages, snapshot = fan_out([lambda: get_usages(halls, date), laundry_snapshot.get_snapshot])
+        output = {"rooms": []}
+        for hall in halls:
+            hall_data = laundry_snapshot.hall_status(hall, snapshot)
+            hall_data["id"] = hall
+            hall_data["usage_data"] = usages[hall]
+            output["rooms"].append(hall_data)
+    except (futures.TimeoutError, HTTPError):
+        return jsonify({"error": "The laundry api is currently unavailable."})
     return jsonify(output)
 
 
 @app.route("/laundry/hall/<int:hall_id>", methods=["GET"])
 def hall(hall_id):
     try:
-        return jsonify(laundry.hall_status(hall_id))
+        return jsonify(laundry_snapshot.hall_status(hall_id))
     except ValueError:
         return jsonify({"error": "Invalid hall id passed to server."})
     except HTTPError:
@@ -48,7 +84,7 @@ def hall(hall_id):
 @app.route("/laundry/hall/<int:hall_id>/<int:hall_id2>", methods=["GET"])
 def two_halls(hall_id, hall_id2):
     try:
-        to_ret = {"halls": [laundry.hall_status(hall_id), laundry.hall_status(hall_id2)]}
+        to_ret = {"halls": [laundry_snapshot.hall_status(hall_id), laundry_snapshot.hall_status(hall_id2)]}
         return jsonify(to_ret)
     except ValueError:
         return jsonify({"error": "Invalid hall id passed to server."})
@@ -56,6 +92,30 @@ def two_halls(hall_id, hall_id2):
         return jsonify({"error": "The laundry api is currently unavailable."})
 
 
+def fan_out(funcs):
+    """Calls every one of funcs concurrently on fanout_executor, and returns their results in order.
+
+    Raises the first exception any of them raised, or TimeoutError if they didn't all finish within
+    FANOUT_DEADLINE.
+    """
+    deadline = time.time() + FANOUT_DEADLINE.total_seconds()
+    stats = query_stats.current()
+    pending = [fanout_executor.submit(_in_app_context, func, stats) for func in funcs]
+    try:
+        return [future.result(timeout=max(deadline - time.time(), 0)) for future in pending]
+    finally:
+        # Nobody is waiting for the calls that haven't started yet
+        for future in pending:
+            future.cancel()
+
+
+def _in_app_context(func, stats=None):
+    with app.app_context():
+        # Queries made here count toward the request that fanned out
+        g.query_stats = stats
+        return func()
+
+
 @app.route("/laundry/halls/ids", methods=["GET"])
 def id_to_name():
     try:
@@ -76,91 +136,103 @@ def usage_shortcut(hall_no):
 
 
 def usage_data(hall_no, year, month, day):
-    # turn date info into a date object
+    return usage_data_many([hall_no], datetime.date(year, month, day))[hall_no]
+
+
+def usage_data_many(hall_nos, now):
+    """Returns {hall_no: usage data} for each of hall_nos on the date now, from a single query."""
     # find start range by subtracting 30 days
-    now = datetime.date(year, month, day)
     start = now - datetime.timedelta(days=30)
 
     # get the current day of the week for today and tomorrow
-    # python dow is monday = 0, while sql dow is sunday = 0
-    dow = (now.weekday() + 1) % 7
+    dow = now.weekday()
     tmw = (dow + 1) % 7
 
-    # some commands are different between mysql and sqlite
-    is_mysql = sqldb.engine.name == "mysql"
-
-    # get the laundry information for today based on the day
+    # get the hourly laundry usage for today based on the day
     # of week (if today is tuesday, get all the tuesdays
-    # in the past 30 days), group them by time, and include
-    # the first 2 hours of the next day
-    data = (
-        sqldb.session.query(
-            LaundrySnapshot.date,
-            (
-                func.floor(LaundrySnapshot.time / 60).label("time")
-                if is_mysql
-                else cast(LaundrySnapshot.time / 60, Integer).label("time")
-            ),
-            func.avg(LaundrySnapshot.washers).label("all_washers"),
-            func.avg(LaundrySnapshot.dryers).label("all_dryers"),
-            func.avg(LaundrySnapshot.total_washers).label("all_total_washers"),
-            func.avg(LaundrySnapshot.total_dryers).label("all_total_dryers"),
-        )
+    # in the past 30 days), and include the first 3 hours of the next day
+    rows = (
+        sqldb.session.query(*USAGE_COLUMNS)
         .filter(
-            (
-                (LaundrySnapshot.room == hall_no)
-                & (
-                    (
-                        func.dayofweek(LaundrySnapshot.date) == dow + 1
-                        if is_mysql
-                        else func.strftime("%w", LaundrySnapshot.date) == str(dow)
-                    )
-                    | (
-                        (LaundrySnapshot.time <= 180 - 1)
-                        & (
-                            func.dayofweek(LaundrySnapshot.date) == tmw + 1
-                            if is_mysql
-                            else func.strftime("%w", LaundrySnapshot.date) == str(tmw)
-                        )
-                    )
-                )
-                & (LaundrySnapshot.date >= start)
-            )
+            LaundryUsage.room.in_(hall_nos)
+            & LaundryUsage.day_of_week.in_([dow, tmw])
+            & (LaundryUsage.date >= start)
         )
-        .group_by(LaundrySnapshot.date, "time")
-        .order_by(LaundrySnapshot.date, "time")
+        .order_by(LaundryUsage.date, LaundryUsage.hour)
         .all()
     )
-    data = [x._asdict() for x in data]
-    all_dryers = [int(x["all_total_dryers"]) for x in data]
-    all_washers = [int(x["all_total_washers"]) for x in data]
-    washer_points = {k: 0 for k in range(27)}
-    dryer_points = {k: 0 for k in range(27)}
-    washer_total = {k: 0 for k in range(27)}
-    dryer_total = {k: 0 for k in range(27)}
-    for x in data:
-        hour = int(x["time"])
-        # if the value is for tomorrow, add 24 hours
-        if x["date"].weekday() != now.weekday():
-            hour += 24
-        washer_points[hour] += int(x["all_washers"])
-        dryer_points[hour] += int(x["all_dryers"])
-        washer_total[hour] += 1
-        dryer_total[hour] += 1
-    dates = [x["date"] for x in data]
-    if not dates:
-        dates = [now]
-    return {
-        "hall_name": laundry.id_to_hall[hall_no],
-        "location": laundry.id_to_location[hall_no],
-        "day_of_week": calendar.day_name[now.weekday()],
-        "start_date": min(dates).strftime("%Y-%m-%d"),
-        "end_date": max(dates).strftime("%Y-%m-%d"),
-        "total_number_of_dryers": safe_division(sum(all_dryers), len(all_dryers)),
-        "total_number_of_washers": safe_division(sum(all_washers), len(all_washers)),
-        "washer_data": {x: safe_division(washer_points[x], washer_total[x]) for x in washer_points},
-        "dryer_data": {x: safe_division(dryer_points[x], dryer_total[x]) for x in dryer_points},
-    }
+    return usage_profiles(hall_nos, now, rows)
+
+
+# The LaundryUsage columns usage_profiles works on, in order
+USAGE_COLUMNS = [
+    LaundryUsage.room,
+    LaundryUsage.day_of_week,
+    LaundryUsage.date,
+    LaundryUsage.hour,
+    LaundryUsage.washers,
+    LaundryUsage.dryers,
+    LaundryUsage.total_washers,
+    LaundryUsage.total_dryers,
+    LaundryUsage.snapshots,
+]
+
+
+def usage_profiles(hall_nos, now, rows):
+    """Averages LaundryUsage rows (tuples of USAGE_COLUMNS, ordered by date) into the usage data of
+    each of hall_nos for the date now.
+
+    The usage for an hour is the average, over the dates in rows, of the (truncated) average number
+    of open machines during that hour. Every hall is summed up at once, with one bincount over
+    (hall, hour) slots per column.
+    """
+    columns = list(zip(*rows)) or [()] * len(USAGE_COLUMNS)
+    dates = columns.pop(2)
+    rooms, days, hours, washers, dryers, total_washers, total_dryers, snapshots = (
+        np.array(column, dtype=int) for column in columns
+    )
+
+    # only the first 3 hours of tomorrow are used, shifted to hours 24 to 26
+    dow = now.weekday()
+    keep = np.flatnonzero((days == dow) | (hours < 3))
+    hours = np.where(days == dow, hours, hours + 24)[keep]
+    snapshots = snapshots[keep]
+
+    halls = np.unique(hall_nos)
+    hall = np.searchsorted(halls, rooms[keep])
+    slot = hall * 27 + hours
+
+    def per_hall(values):
+        return np.bincount(hall, weights=values[keep] // snapshots, minlength=len(halls)).tolist()
+
+    def per_hour(values):
+        return np.bincount(slot, weights=values[keep] // snapshots, minlength=len(halls) * 27).reshape(-1, 27).tolist()
+
+    counts = np.bincount(hall, minlength=len(halls)).tolist()
+    hourly_counts = np.bincount(slot, minlength=len(halls) * 27).reshape(-1, 27).tolist()
+    washer_points, dryer_points = per_hour(washers), per_hour(dryers)
+    all_washers, all_dryers = per_hall(total_washers), per_hall(total_dryers)
+
+    # rows are ordered by date, so each hall's first and last rows have its earliest and latest dates
+    first = dict(zip(*[x.tolist() for x in np.unique(hall, return_index=True)]))
+    last = dict(zip(*[x.tolist() for x in np.unique(hall[::-1], return_index=True)]))
+
+    profiles = {}
+    for i, hall_no in enumerate(halls.tolist()):
+        start_date = dates[keep[first[i]]] if i in first else now
+        end_date = dates[keep[len(keep) - 1 - last[i]]] if i in last else now
+        profiles[hall_no] = {
+            "hall_name": laundry.id_to_hall[hall_no],
+            "location": laundry.id_to_location[hall_no],
+            "day_of_week": calendar.day_name[dow],
+            "start_date": start_date.strftime("%Y-%m-%d"),
+            "end_date": end_date.strftime("%Y-%m-%d"),
+            "total_number_of_dryers": safe_division(int(all_dryers[i]), counts[i]),
+            "total_number_of_washers": safe_division(int(all_washers[i]), counts[i]),
+            "washer_data": {x: safe_division(int(washer_points[i][x]), hourly_counts[i][x]) for x in range(27)},
+            "dryer_data": {x: safe_division(int(dryer_points[i][x]), hourly_counts[i][x]) for x in range(27)},
+        }
+    return profiles
 
 
 @app.route("/laundry/usage/<int:hall_no>/<int:year>-<int:month>-<int:day>", methods=["GET"])
@@ -168,51 +240,267 @@ def usage(hall_no, year, month, day):
     def get_data():
         return usage_data(hall_no, year, month, day)
 
-    td = datetime.timedelta(minutes=15)
-    return cached_route("laundry:usage:%s:%s-%s-%s" % (hall_no, year, month, day), td, get_data)
+    return cached_route(usage_key(hall_no, year, month, day), USAGE_TD, get_data, soft_td=USAGE_SOFT_TD)
+
+
+@app.route("/laundry/usage", methods=["GET"])
+def all_usage():
+    est = timezone("EST")
+    date = datetime.datetime.now(est)
+    halls = [hall["id"] for hall in laundry.hall_id_list]
+    usages = get_usages(halls, date)
+    return jsonify({"halls": [dict(usages[hall], id=hall) for hall in halls]})
+
+
+def get_usages(halls, date):
+    """Returns {hall: usage data} for each of halls on date, sharing cache entries with /laundry/usage/<hall>."""
+    usage_keys = {hall: usage_key(hall, date.year, date.month, date.day) for hall in halls}
+    key_to_hall = {key: hall for hall, key in usage_keys.items()}
+
+    def get_data(keys):
+        # The halls that aren't cached are all loaded with one query
+        data = usage_data_many([key_to_hall[key] for key in keys], datetime.date(date.year, date.month, date.day))
+        return {key: data[key_to_hall[key]] for key in keys}
+
+    usages = cache_get_many(usage_keys.values(), USAGE_TD, get_data, soft_td=USAGE_SOFT_TD)
+    return {hall: usages[key] for hall, key in usage_keys.items()}
+
+
+def usage_key(hall_no, year, month, day):
+    return "laundry:usage:%s:%s-%s-%s" % (hall_no, year, month, day)
 
 
 def save_data():
-    """Retrieves current laundry info and saves it into the database."""
+    """Retrieves current laundry info and saves it into the database.
 
-    # get the number of minutes since midnight
-    est = timezone("EST")
-    now = datetime.datetime.now(est)
-    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    date = now.date()
-    time = round((now - midnight).seconds / 60)
+    Each run saves every hall with one INSERT that skips halls already saved for the minute, so
+    runs that overlap or are retried don't save a minute twice. Rows are stamped with the minute the
+    snapshot was scraped rather than the time of the run, so a snapshot served again from the cache
+    is skipped the same way. Snapshots whose version was already saved are skipped before that,
+    without touching the database.
+    """
 
-    # check if we already have data for this minute
-    # if we do, skip
     with app.app_context():
-        if sqldb.session.query(
-            exists().where((LaundrySnapshot.date == date) & (LaundrySnapshot.time == time))
-        ).scalar():
+        snapshot = laundry_snapshot.get_snapshot()
+        if db.get(SAVED_VERSION_KEY) == str(snapshot["version"]).encode("utf8"):
             return
 
-        # make a dict for hall name -> id
-        ids = {x["hall_name"]: x["id"] for x in laundry.hall_id_list}
-        data = laundry.all_status()
-        for name, room in data.items():
-            id = ids[name]
-            dryers = room["dryers"]["open"]
-            washers = room["washers"]["open"]
-            total_dryers = sum(
-                [room["dryers"][x] for x in ["open", "running", "offline", "out_of_order"]]
+        # get the number of minutes since midnight
+        est = timezone("EST")
+        scraped_at = datetime.datetime.fromtimestamp(snapshot["scraped_at"], est)
+        midnight = scraped_at.replace(hour=0, minute=0, second=0, microsecond=0)
+        date = scraped_at.date()
+        time = round((scraped_at - midnight).seconds / 60)
+
+        rows = []
+        for id, hall_data in snapshot["halls"].items():
+            room = hall_data["machines"]
+            rows.append(
+                {
+                    "date": date,
+                    "time": time,
+                    "room": int(id),
+                    "washers": room["washers"]["open"],
+                    "dryers": room["dryers"]["open"],
+                    "total_washers": sum(
+                        [room["washers"][x] for x in ["open", "running", "offline", "out_of_order"]]
+                    ),
+                    "total_dryers": sum(
+                        [room["dryers"][x] for x in ["open", "running", "offline", "out_of_order"]]
+                    ),
+                }
             )
-            total_washers = sum(
-                [room["washers"][x] for x in ["open", "running", "offline", "out_of_order"]]
+        if not rows:
+            return
+
+        inserted = sqldb.session.execute(insert_ignore(LaundrySnapshot).values(rows)).rowcount
+        if inserted == len(rows):
+            roll_up_snapshots(rows)
+        elif inserted:
+            # Some halls were already saved for this minute, so recount the day from what was saved
+            roll_up_day(date)
+        sqldb.session.commit()
+        db.set(SAVED_VERSION_KEY, snapshot["version"])
+
+
+def snapshot_hour(time):
+    """The hour of a LaundrySnapshot time (minutes since midnight), in SQL."""
+    if sqldb.engine.name == "mysql":
+        return func.floor(time / 60)
+    return cast(time / 60, Integer)
+
+
+def roll_up_snapshots(snapshots):
+    """Adds LaundrySnapshot rows (dicts of their columns) to the hourly totals in LaundryUsage, in
+    the current transaction.
+    """
+    totals = {}
+    for row in snapshots:
+        key = (row["room"], row["date"].weekday(), row["date"], row["time"] // 60)
+        total = totals.setdefault(key, [0, 0, 0, 0, 0])
+        for i, column in enumerate(["washers", "dryers", "total_washers", "total_dryers"]):
+            total[i] += row[column]
+        total[4] += 1
+    if not totals:
+        return
+
+    keys = [{"room": room, "day_of_week": dow, "date": date, "hour": hour} for room, dow, date, hour in totals]
+    sqldb.session.execute(
+        insert_ignore(LaundryUsage),
+        [dict(key, washers=0, dryers=0, total_washers=0, total_dryers=0, snapshots=0) for key in keys],
+    )
+    table = LaundryUsage.__table__
+    columns = ["washers", "dryers", "total_washers", "total_dryers", "snapshots"]
+    sqldb.session.execute(
+        table.update()
+        .where(
+            (table.c.room == sqldb.bindparam("key_room"))
+            & (table.c.day_of_week == sqldb.bindparam("key_day_of_week"))
+            & (table.c.date == sqldb.bindparam("key_date"))
+            & (table.c.hour == sqldb.bindparam("key_hour"))
+        )
+        .values({column: table.c[column] + sqldb.bindparam("new_" + column) for column in columns}),
+        [
+            dict(
+                {"key_" + name: value for name, value in key.items()},
+                **{"new_" + column: value for column, value in zip(columns, total)}
             )
-            item = LaundrySnapshot(
+            for key, total in zip(keys, totals.values())
+        ],
+    )
+
+
+def rebuild_usage():
+    """Recomputes LaundryUsage from every LaundrySnapshot, a day at a time. Days whose snapshots have
+    been retired keep their totals.
+    """
+    with app.app_context():
+        dates = sqldb.session.query(LaundrySnapshot.date).distinct().order_by(LaundrySnapshot.date)
+        for date in [date for (date,) in dates]:
+            roll_up_day(date)
+            sqldb.session.commit()
+
+
+def roll_up_day(date):
+    """Replaces the LaundryUsage rows for date with totals of its LaundrySnapshots, in the current
+    transaction.
+    """
+    LaundryUsage.query.filter_by(date=date).delete()
+    hour = snapshot_hour(LaundrySnapshot.time)
+    totals = (
+        sqldb.session.query(
+            LaundrySnapshot.room,
+            hour,
+            func.sum(LaundrySnapshot.washers),
+            func.sum(LaundrySnapshot.dryers),
+            func.sum(LaundrySnapshot.total_washers),
+            func.sum(LaundrySnapshot.total_dryers),
+            func.count(),
+        )
+        .filter(LaundrySnapshot.date == date)
+        .group_by(LaundrySnapshot.room, hour)
+    )
+    for room, hour_of_day, washers, dryers, total_washers, total_dryers, snapshots in totals:
+        sqldb.session.add(
+            LaundryUsage(
+                room=room,
+                day_of_week=date.weekday(),
                 date=date,
-                time=time,
-                room=id,
-                washers=washers,
-                dryers=dryers,
-                total_washers=total_washers,
-                total_dryers=total_dryers,
+                hour=int(hour_of_day),
+                washers=int(washers),
+                dryers=int(dryers),
+                total_washers=int(total_washers),
+                total_dryers=int(total_dryers),
+                snapshots=snapshots,
             )
-            sqldb.session.add(item)
+        )
+
+
+def retire_snapshots(now=None, archive=None):
+    """Archives and then deletes the LaundrySnapshots older than SNAPSHOT_RETENTION, a day at a time.
+
+    Each day's hourly totals are recomputed from its snapshots first, so LaundryUsage still has them
+    once the snapshots are gone. Returns the dates retired.
+    """
+    archive = archive or SNAPSHOT_ARCHIVE
+    if not archive:
+        raise ValueError("Set LAUNDRY_SNAPSHOT_ARCHIVE to retire laundry snapshots.")
+
+    est = timezone("EST")
+    now = now or datetime.datetime.now(est)
+    cutoff = (now - SNAPSHOT_RETENTION).date()
+
+    with app.app_context():
+        dates = (
+            sqldb.session.query(LaundrySnapshot.date)
+            .filter(LaundrySnapshot.date < cutoff)
+            .distinct()
+            .order_by(LaundrySnapshot.date)
+        )
+        dates = [date for (date,) in dates]
+        for date in dates:
+            roll_up_day(date)
+            sqldb.session.commit()
+            archive_snapshots(archive, date)
+            delete_snapshots(date)
+    return dates
+
+
+def archive_snapshots(archive, date):
+    """Writes the LaundrySnapshots for date to laundry_snapshot/<date>.csv.gz under archive.
+
+    An archive that already exists is left alone. Snapshots are only deleted once they are archived, so
+    it holds every snapshot that is left, and more if an earlier run was interrupted while deleting.
+    """
+    name = "laundry_snapshot/%s.csv.gz" % date.isoformat()
+    if archive.startswith("s3://"):
+        bucket, _, prefix = archive[len("s3://"):].partition("/")
+        key = "/".join(filter(None, [prefix.strip("/"), name]))
+        if s3.list_objects_v2(Bucket=bucket, Prefix=key).get("KeyCount"):
+            return
+        s3.put_object(Bucket=bucket, Key=key, Body=snapshots_csv(date), ACL="private")
+    else:
+        path = os.path.join(archive, name)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(snapshots_csv(date))
+        # Only complete archives ever have the real name
+        os.replace(path + ".tmp", path)
+
+
+def snapshots_csv(date):
+    """The LaundrySnapshots for date as a gzipped CSV, in time and then room order."""
+    columns = ["date", "time", "room", "washers", "dryers", "total_washers", "total_dryers"]
+    rows = (
+        sqldb.session.query(*[LaundrySnapshot.__table__.c[column] for column in columns])
+        .filter(LaundrySnapshot.date == date)
+        .order_by(LaundrySnapshot.time, LaundrySnapshot.room)
+    )
+    data = io.BytesIO()
+    with gzip.GzipFile(fileobj=data, mode="wb", mtime=0) as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        writer.writerows(rows.yield_per(SNAPSHOT_DELETE_BATCH))
+        text.flush()
+        text.detach()
+    return data.getvalue()
+
+
+def delete_snapshots(date):
+    """Deletes the LaundrySnapshots for date, committing every SNAPSHOT_DELETE_BATCH rows."""
+    while True:
+        ids = [
+            id
+            for (id,) in sqldb.session.query(LaundrySnapshot.id)
+            .filter(LaundrySnapshot.date == date)
+            .limit(SNAPSHOT_DELETE_BATCH)
+        ]
+        if not ids:
+            return
+        LaundrySnapshot.query.filter(LaundrySnapshot.id.in_(ids)).delete(synchronize_session=False)
         sqldb.session.commit()
 
 
@@ -246,7 +534,7 @@ def save_laundry_preferences():
 @app.route("/laundry/preferences", methods=["GET"])
 def get_laundry_preferences():
     try:
-        user = User.get_or_create()
+        user = User.get_user()
     except ValueError:
         return jsonify({"rooms": []})
 
@@ -264,5 +552,6 @@ def get_laundry_status():
             error_msg = "Penn's laundry server is currently not updating. We hope this will be fixed shortly."
             return {"is_working": False, "error_msg": error_msg}
 
-    td = datetime.timedelta(hours=1)
-    return cached_route("laundry:working", td, get_data)
+    td = datetime.timedelta(days=1)
+    soft_td = datetime.timedelta(hours=1)
+    return cached_route("laundry:working", td, get_data, soft_td=soft_td)
@@ -0,0 +1,91 @@
+import copy
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import HTTPError
+
+from server import db
+from server.base import cache_get
+from server.penndata import laundry
+
+
+logger = logging.getLogger(__name__)
+
+# Every hall is scraped at most once per interval, no matter how many requests ask for them.
+# Readers keep getting the previous snapshot while the next one is scraped in the background.
+SNAPSHOT_KEY = "laundry:snapshot"
+SNAPSHOT_INTERVAL = datetime.timedelta(minutes=1)
+
+# A snapshot this old is no longer served, since machine statuses change by the minute
+SNAPSHOT_TD = datetime.timedelta(minutes=10)
+
+# Bumped on every scrape, so readers like save_data can tell a new snapshot from one served again
+VERSION_KEY = "laundry:snapshot:version"
+
+# Halls are scraped concurrently on this pool, sized to match the connection pool for the laundry
+# site (see server/http_client.py)
+scrape_executor = ThreadPoolExecutor(max_workers=8)
+
+
+def get_snapshot():
+    """Returns the latest snapshot of every laundry room, scraping them all if there is none.
+
+    The snapshot looks like {"version": 12, "scraped_at": 1500000000.0, "halls": {"1": {...}}}, with
+    each hall in the format returned by hall_status.
+    """
+    return cache_get(SNAPSHOT_KEY, SNAPSHOT_TD, scrape, soft_td=SNAPSHOT_INTERVAL, local=True, compress=True)
+
+
+def scrape():
+    """Scrapes every laundry room.
+
+    Rooms that fail to scrape are left out of the snapshot, unless every one of them fails.
+    """
+    scraped_at = time.time()
+    names = {hall["id"]: hall["hall_name"] for hall in laundry.hall_id_list}
+    results = scrape_executor.map(_scrape_hall, names.values())
+    halls = {}
+    errors = []
+    for (hall_id, name), (hall_machines, error) in zip(names.items(), results):
+        if error is not None:
+            logger.warning("Couldn't scrape laundry room %s (%s): %r", hall_id, name, error)
+            errors.append(error)
+            continue
+        halls[str(hall_id)] = {
+            "machines": hall_machines,
+            "hall_name": name,
+            "location": laundry.id_to_location[hall_id],
+        }
+    if errors and not halls:
+        raise errors[0]
+    return {"version": db.incr(VERSION_KEY), "scraped_at": scraped_at, "halls": halls}
+
+
+def _scrape_hall(name):
+    """Returns (machines, None) for the room, or (None, the error) if it couldn't be scraped."""
+    try:
+        return laundry.parse_a_hall(name), None
+    except Exception as e:
+        return None, e
+
+
+def all_status():
+    """Same as laundry.all_status, read from the snapshot."""
+    return {hall["hall_name"]: copy.deepcopy(hall["machines"]) for hall in get_snapshot()["halls"].values()}
+
+
+def hall_status(hall_id, snapshot=None):
+    """Same as laundry.hall_status, read from snapshot (or the latest snapshot).
+
+    Raises HTTPError if the hall was left out of the snapshot because it couldn't be scraped.
+    """
+    if hall_id not in laundry.id_to_hall:
+        raise ValueError("No hall with id %s exists." % hall_id)
+    if snapshot is None:
+        snapshot = get_snapshot()
+    if str(hall_id) not in snapshot["halls"]:
+        raise HTTPError("Hall %s couldn't be scraped." % hall_id)
+    # The snapshot is shared with other requests, so callers get a copy they can modify
+    return copy.deepcopy(snapshot["halls"][str(hall_id)])
@@ -0,0 +1,105 @@
+import datetime
+import re
+import threading
+import time
+
+from flask import Response
+
+from server import app, db
+from server.auth import internal_auth
+
+
+# Counters are kept in memory and added to the totals in Redis at most this often
+FLUSH_INTERVAL = datetime.timedelta(seconds=10)
+
+# Redis hash of every series, shared by all processes
+METRICS_KEY = "metrics:counters"
+
+# What each metric means, for the HELP and TYPE lines
+METRICS = {
+    "cache_hits_total": ("counter", "Cache lookups answered from the cache, by tier."),
+    "cache_stale_hits_total": ("counter", "Cache hits on values past their soft TTL."),
+    "cache_misses_total": ("counter", "Cache lookups that had to call the loader."),
+    "cache_errors_total": ("counter", "Loader calls that raised."),
+    "cache_load_seconds": ("summary", "Time spent in loaders."),
+    "cache_value_bytes": ("summary", "Size of the values written to the cache, as stored."),
+    "upstream_errors_total": ("counter", "Upstream calls that failed, by upstream."),
+    "upstream_short_circuits_total": ("counter", "Upstream calls skipped because the upstream is down."),
+}
+
+
+class Metrics(object):
+    """Counters for this process, periodically added to the totals in Redis.
+
+    Every process (and every pod) adds to the same hash, so the endpoint below reports totals for
+    the whole deployment no matter which process answers it.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval.total_seconds()
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.time()
+
+    def incr(self, name, labels, value=1):
+        series = _series(name, labels)
+        with self.lock:
+            self.counters[series] = self.counters.get(series, 0) + value
+            due = time.time() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def observe(self, name, labels, value):
+        """Records one observation of a summary metric."""
+        self.incr(name + "_sum", labels, value)
+        self.incr(name + "_count", labels)
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            self.last_flush = time.time()
+        if not counters:
+            return
+        try:
+            pipe = db.pipeline(transaction=False)
+            for series, value in counters.items():
+                pipe.hincrbyfloat(METRICS_KEY, series, value)
+            pipe.execute()
+        except Exception:
+            # Keep the counts around for the next flush rather than losing them
+            with self.lock:
+                for series, value in counters.items():
+                    self.counters[series] = self.counters.get(series, 0) + value
+
+    def render(self):
+        """Returns the totals from every process in the Prometheus text format."""
+        self.flush()
+        series = sorted(
+            (series.decode("utf8"), value.decode("utf8")) for series, value in db.hgetall(METRICS_KEY).items()
+        )
+        lines = []
+        described = set()
+        for name, value in series:
+            metric = re.sub(r"(_sum|_count)$", "", name.partition("{")[0])
+            if metric not in described and metric in METRICS:
+                kind, description = METRICS[metric]
+                lines.append("# HELP %s %s" % (metric, description))
+                lines.append("# TYPE %s %s" % (metric, kind))
+                described.add(metric)
+            lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ",".join('%s="%s"' % (k, v) for k, v in sorted(labels.items())))
+
+
+metrics = Metrics(FLUSH_INTERVAL)
+
+
+@app.route("/metrics", methods=["GET"])
+@internal_auth
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,3 +1,4 @@
+import datetime
 import uuid
 
 from flask import request
@@ -6,11 +7,22 @@ from flask_sqlalchemy import SQLAlchemy
 
 sqldb = SQLAlchemy()
 
+# Device ids are stored in an indexed column, so they can't be any longer than this
+DEVICE_ID_MAX_LENGTH = 255
+
+# How long the device id -> user id mapping for a device is kept in Redis
+DEVICE_ID_TD = datetime.timedelta(days=7)
+
 
 def generate_uuid():
     return str(uuid.uuid4())
 
 
+def insert_ignore(model):
+    """An INSERT into the table for model that skips rows whose keys are already there."""
+    return model.__table__.insert().prefix_with("IGNORE" if sqldb.engine.name == "mysql" else "OR IGNORE")
+
+
 class Account(sqldb.Model):
     id = sqldb.Column(sqldb.VARCHAR(255), primary_key=True, default=generate_uuid)
     first = sqldb.Column(sqldb.Text, nullable=True)
@@ -111,8 +123,13 @@ class CourseAnonymousID(sqldb.Model):
 
 
 class LaundrySnapshot(sqldb.Model):
+    __table_args__ = (
+        sqldb.UniqueConstraint("date", "time", "room", name="uq_laundry_snapshot_date_time_room"),
+        sqldb.Index("ix_laundry_snapshot_room_date_time", "room", "date", "time"),
+    )
+
     id = sqldb.Column(sqldb.Integer, primary_key=True)
-    date = sqldb.Column(sqldb.Date, nullable=False, index=True)
+    date = sqldb.Column(sqldb.Date, nullable=False)
     time = sqldb.Column(sqldb.Integer, nullable=False)
     room = sqldb.Column(sqldb.Integer, nullable=False)
     washers = sqldb.Column(sqldb.Integer, nullable=False)
@@ -121,20 +138,35 @@ class LaundrySnapshot(sqldb.Model):
     total_dryers = sqldb.Column(sqldb.Integer, nullable=False)
 
 
+class LaundryUsage(sqldb.Model):
+    """Hourly totals of the LaundrySnapshots of each room, which laundry usage is averaged from.
+
+    Rows are keyed by day of week (Monday is 0) ahead of date, so the usage for a day of the week is
+    a single range scan over the primary key.
+    """
+
+    room = sqldb.Column(sqldb.Integer, primary_key=True)
+    day_of_week = sqldb.Column(sqldb.Integer, primary_key=True)
+    date = sqldb.Column(sqldb.Date, primary_key=True)
+    hour = sqldb.Column(sqldb.Integer, primary_key=True)
+    washers = sqldb.Column(sqldb.Integer, nullable=False)
+    dryers = sqldb.Column(sqldb.Integer, nullable=False)
+    total_washers = sqldb.Column(sqldb.Integer, nullable=False)
+    total_dryers = sqldb.Column(sqldb.Integer, nullable=False)
+    snapshots = sqldb.Column(sqldb.Integer, nullable=False)
+
+
 class User(sqldb.Model):
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     created_at = sqldb.Column(sqldb.DateTime, server_default=sqldb.func.now())
     platform = sqldb.Column(sqldb.Text, nullable=False)
-    device_id = sqldb.Column(sqldb.Text, nullable=False)
+    device_id = sqldb.Column(sqldb.VARCHAR(DEVICE_ID_MAX_LENGTH), nullable=False, index=True)
     email = sqldb.Column(sqldb.Text, nullable=True)
 
     @staticmethod
     def get_or_create(device_id=None, platform=None, email=None):
-        device_id = device_id or request.headers.get("X-Device-ID")
-        if not device_id:
-            raise ValueError("No device ID passed to the server.")
-
-        user = User.query.filter_by(device_id=device_id).first()
+        device_id = User.get_device_id(device_id)
+        user = User.find(device_id)
         if user:
             return user
 
@@ -149,23 +181,63 @@ class User(sqldb.Model):
         user = User(platform=platform, device_id=device_id, email=email)
         sqldb.session.add(user)
         sqldb.session.commit()
+        User.remember(device_id, user.id)
         return user
 
     @staticmethod
     def get_user():
-        device_id = request.headers.get("X-Device-ID")
+        user = User.find(User.get_device_id())
+        if not user:
+            raise ValueError("Unable to authenticate on the server.")
+        return user
+
+    @staticmethod
+    def get_device_id(device_id=None):
+        device_id = device_id or request.headers.get("X-Device-ID")
         if not device_id:
             raise ValueError("No device ID passed to the server.")
+        if len(device_id) > DEVICE_ID_MAX_LENGTH:
+            raise ValueError("Invalid device ID passed to the server.")
+        return device_id
+
+    @staticmethod
+    def find(device_id):
+        """Returns the User with device_id, or None if there isn't one yet.
+
+        Device ids are mapped to user ids in Redis, so known devices are loaded by primary key rather
+        than through the device_id index. Mappings whose user no longer exists, because it was deleted
+        or the database was reset, are dropped.
+        """
+        from server import db
+
+        key = User.device_key(device_id)
+        user_id = db.get(key)
+        if user_id is not None:
+            user = User.query.get(int(user_id))
+            if user is not None and user.device_id == device_id:
+                return user
+            db.delete(key)
+
         user = User.query.filter_by(device_id=device_id).first()
-        if not user:
-            raise ValueError("Unable to authenticate on the server.")
+        if user:
+            User.remember(device_id, user.id)
         return user
 
+    @staticmethod
+    def remember(device_id, user_id):
+        from server import db
+
+        db.set(User.device_key(device_id), user_id, ex=int(DEVICE_ID_TD.total_seconds()))
+
+    @staticmethod
+    def device_key(device_id):
+        return "user:device:%s" % device_id
+
 
 class LaundryPreference(sqldb.Model):
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     created_at = sqldb.Column(sqldb.DateTime, server_default=sqldb.func.now())
-    user_id = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"), nullable=False)
+    user_id = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"), nullable=False, index=True)
     account = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"), nullable=True)
     room_id = sqldb.Column(sqldb.Integer, nullable=False)
 
@@ -173,12 +245,14 @@ class LaundryPreference(sqldb.Model):
 class DiningPreference(sqldb.Model):
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     created_at = sqldb.Column(sqldb.DateTime, server_default=sqldb.func.now())
-    user_id = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"), nullable=False)
+    user_id = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"), nullable=False, index=True)
     account = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"), nullable=True)
     venue_id = sqldb.Column(sqldb.Integer, nullable=False)
 
 
 class DiningBalance(sqldb.Model):
+    __table_args__ = (sqldb.Index("ix_dining_balance_account_id_created_at", "account_id", "created_at"),)
+
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     account_id = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"))
     dining_dollars = sqldb.Column(sqldb.Float, nullable=False)
@@ -188,6 +262,8 @@ class DiningBalance(sqldb.Model):
 
 
 class DiningTransaction(sqldb.Model):
+    __table_args__ = (sqldb.Index("ix_dining_transaction_account_id_date", "account_id", "date"),)
+
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     account_id = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"))
     date = sqldb.Column(sqldb.DateTime, nullable=False)
@@ -211,6 +287,10 @@ class Event(sqldb.Model):
 
 
 class AnalyticsEvent(sqldb.Model):
+    __table_args__ = (
+        sqldb.Index("ix_analytics_event_type_post_id_is_interaction", "type", "post_id", "is_interaction"),
+    )
+
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     user = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"))
     account_id = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"), nullable=True)
@@ -222,6 +302,23 @@ class AnalyticsEvent(sqldb.Model):
     created_at = sqldb.Column(sqldb.DateTime, server_default=sqldb.func.now())
 
 
+class PostAnalytics(sqldb.Model):
+    """Daily totals of the post events in AnalyticsEvent, updated as events are sent."""
+
+    post_id = sqldb.Column(sqldb.VARCHAR(255), primary_key=True)
+    day = sqldb.Column(sqldb.Date, primary_key=True)
+    interactions = sqldb.Column(sqldb.Integer, nullable=False, default=0)
+    impressions = sqldb.Column(sqldb.Integer, nullable=False, default=0)
+
+
+class PostAnalyticsUser(sqldb.Model):
+    """The users who saw each post on each day, which unique impressions are counted from."""
+
+    post_id = sqldb.Column(sqldb.VARCHAR(255), primary_key=True)
+    day = sqldb.Column(sqldb.Date, primary_key=True)
+    user = sqldb.Column(sqldb.Integer, primary_key=True)
+
+
 class PostAccount(sqldb.Model):
     id = sqldb.Column(sqldb.VARCHAR(255), primary_key=True, default=generate_uuid)
     name = sqldb.Column(sqldb.Text, nullable=False)
@@ -1,9 +1,9 @@
-import requests
 from bs4 import BeautifulSoup
 from flask import jsonify
 from requests.exceptions import ConnectionError
 
 from server import app
+from server.http_client import http
 
 
 BASE_URL = "https://www.thedp.com/"
@@ -22,7 +22,7 @@ def fetch_frontpage_article():
     """Returns a list of articles."""
     try:
         url = BASE_URL
-        resp = requests.get(url)
+        resp = http.get(url)
     except ConnectionError:
         return None
 
@@ -1,14 +1,14 @@
 import datetime
 
-import requests
 from flask import Response
 
 from server import app
+from server.http_client import http
 
 
 @app.route("/nso")
 def get_nso_events():
-    r = requests.get("http://www.nso.upenn.edu/event-calendar.rss")
+    r = http.get("http://www.nso.upenn.edu/event-calendar.rss")
     split = r.text.split("\n")
     # TODO: Rework into for-loop
     filtered = [
@@ -1,20 +1,41 @@
 from os import getenv
 
+import penn.base
+import penn.calendar3year
+import penn.fitness
+import penn.laundry
+import penn.studyspaces
+import penn.wharton
 from penn import Calendar, Dining, DiningV2, Directory, Fitness, Laundry, Map, Registrar, StudySpaces, Transit, Wharton
+from penn.base import APIError
+from requests.exceptions import HTTPError
 
+from server.breaker import CircuitBreaker
+from server.http_client import http
 
-din = Dining(getenv("DIN_USERNAME"), getenv("DIN_PASSWORD"))
-dinV2 = DiningV2(getenv("DIN_USERNAME"), getenv("DIN_PASSWORD"))
-reg = Registrar(getenv("REG_USERNAME"), getenv("REG_PASSWORD"))
-penn_dir = Directory(getenv("DIR_USERNAME"), getenv("DIR_PASSWORD"))
-map_search = Map(getenv("NEM_USERNAME"), getenv("NEM_PASSWORD"))
-transit = Transit(getenv("TRANSIT_USERNAME"), getenv("TRANSIT_PASSWORD"))
-laundry = Laundry()
-studyspaces = StudySpaces(getenv("LIBCAL_ID"), getenv("LIBCAL_SECRET"))
-wharton = Wharton()
-fitness = Fitness(getenv("FITNESS_TOKEN"))
-calendar = Calendar()
-wharton = Wharton()
+
+# The SDK calls requests directly, so point it at our connection pools instead
+penn.base.get = http.get
+for module in [penn.calendar3year, penn.fitness, penn.laundry, penn.studyspaces, penn.wharton]:
+    module.requests = http
+
+# Every client is wrapped in a circuit breaker, which raises the same errors the routes already
+# handle for that upstream while it is down
+din = CircuitBreaker(Dining(getenv("DIN_USERNAME"), getenv("DIN_PASSWORD")), "dining", APIError)
+dinV2 = CircuitBreaker(DiningV2(getenv("DIN_USERNAME"), getenv("DIN_PASSWORD")), "dining", APIError)
+reg = CircuitBreaker(Registrar(getenv("REG_USERNAME"), getenv("REG_PASSWORD")), "registrar", APIError)
+penn_dir = CircuitBreaker(
+    Directory(getenv("DIR_USERNAME"), getenv("DIR_PASSWORD")), "directory", APIError, local=["standardize"]
+)
+map_search = CircuitBreaker(Map(getenv("NEM_USERNAME"), getenv("NEM_PASSWORD")), "map", APIError)
+transit = CircuitBreaker(
+    Transit(getenv("TRANSIT_USERNAME"), getenv("TRANSIT_PASSWORD")), "transit", APIError, local=["format_date"]
+)
+laundry = CircuitBreaker(Laundry(), "laundry", HTTPError)
+studyspaces = CircuitBreaker(StudySpaces(getenv("LIBCAL_ID"), getenv("LIBCAL_SECRET")), "libcal", APIError)
+fitness = CircuitBreaker(Fitness(getenv("FITNESS_TOKEN")), "fitness", APIError)
+calendar = CircuitBreaker(Calendar(), "calendar", APIError)
+wharton = CircuitBreaker(Wharton(), "wharton", APIError, local=["switch_format", "get_dst_gmt_timezone"])
 depts = {
     "AAMW": "Art & Arch of Med. World",
     "ACCT": "Accounting",
@@ -2,115 +2,95 @@ from datetime import datetime
 
 from flask import jsonify, request
 from pytz import timezone
-from sqlalchemy import and_, desc, func
+from sqlalchemy import and_, case, distinct, func
 
-from server import app, sqldb
-from server.models import (AnalyticsEvent, Post, PostAccount, PostFilter, PostStatus,
-                           PostTargetEmail, PostTester, School, SchoolMajorAccount)
+from server import analytics, app, sqldb
+from server.models import (AnalyticsEvent, Post, PostAccount, PostAnalytics, PostAnalyticsUser, PostFilter,
+                           PostStatus, PostTargetEmail, PostTester, School, SchoolMajorAccount)
 
 
-def get_analytics(posts_query):
-    qry1 = (
-        sqldb.session.query(
-            AnalyticsEvent.post_id.label("id"),
-            func.count(AnalyticsEvent.post_id).label("interactions"),
-        )
-        .filter(AnalyticsEvent.type == "post")
-        .filter(AnalyticsEvent.post_id.in_(posts_query))
-        .filter(AnalyticsEvent.is_interaction)
-        .group_by(AnalyticsEvent.post_id)
-        .subquery()
-    )
+def get_analytics(post_ids):
+    """Returns {post_id: (interactions, impressions, unique impressions)} for the posts with post_ids."""
+    if analytics.POST_ANALYTICS_ROLLUP:
+        return get_rolled_up_analytics(post_ids)
+
+    analytics_by_post = {}
+    for post_id, interactions, impressions, unique_impr in analytics_query(post_ids):
+        analytics_by_post[post_id] = (int(interactions), int(impressions), unique_impr)
 
-    qry2 = (
+    return analytics_by_post
+
+
+def analytics_query(post_ids):
+    """One pass over the events for the posts with post_ids, counting interactions, impressions and
+    the users who saw each post.
+    """
+    return (
         sqldb.session.query(
-            AnalyticsEvent.post_id.label("id"),
-            func.count(AnalyticsEvent.post_id).label("impressions"),
+            AnalyticsEvent.post_id,
+            func.sum(case([(AnalyticsEvent.is_interaction, 1)], else_=0)),
+            func.sum(case([(AnalyticsEvent.is_interaction, 0)], else_=1)),
+            func.count(distinct(case([(AnalyticsEvent.is_interaction, None)], else_=AnalyticsEvent.user))),
         )
         .filter(AnalyticsEvent.type == "post")
-        .filter(AnalyticsEvent.post_id.in_(posts_query))
-        .filter(AnalyticsEvent.is_interaction == 0)
+        .filter(AnalyticsEvent.post_id.in_(post_ids))
         .group_by(AnalyticsEvent.post_id)
-        .subquery()
-    )
-
-    qry3_sub = (
-        sqldb.session.query(AnalyticsEvent.post_id.label("id"), AnalyticsEvent.user)
-        .filter(AnalyticsEvent.type == "post")
-        .filter(AnalyticsEvent.post_id.in_(posts_query))
-        .filter(AnalyticsEvent.is_interaction == 0)
-        .group_by(AnalyticsEvent.post_id, AnalyticsEvent.user)
-        .subquery()
     )
 
-    qry3 = (
-        sqldb.session.query(qry3_sub.c.id, func.count(qry3_sub.c.user).label("unique_impr"))
-        .select_from(qry3_sub)
-        .group_by(qry3_sub.c.id)
-        .subquery()
-    )
 
-    analytics_qry = (
-        sqldb.session.query(qry1.c.id, qry1.c.interactions, qry2.c.impressions, qry3.c.unique_impr)
-        .select_from(qry1)
-        .join(qry2, qry1.c.id == qry2.c.id)
-        .join(qry3, and_(qry1.c.id == qry2.c.id, qry2.c.id == qry3.c.id))
+def get_rolled_up_analytics(post_ids):
+    """Same as get_analytics, read from the daily rollups rather than the events."""
+    totals = (
+        sqldb.session.query(
+            PostAnalytics.post_id, func.sum(PostAnalytics.interactions), func.sum(PostAnalytics.impressions)
+        )
+        .filter(PostAnalytics.post_id.in_(post_ids))
+        .group_by(PostAnalytics.post_id)
         .all()
     )
+    unique_by_post = dict(
+        sqldb.session.query(PostAnalyticsUser.post_id, func.count(distinct(PostAnalyticsUser.user)))
+        .filter(PostAnalyticsUser.post_id.in_(post_ids))
+        .group_by(PostAnalyticsUser.post_id)
+    )
 
     analytics_by_post = {}
-    for post_id, interactions, impressions, unique_impr in analytics_qry:
-        analytics_by_post[post_id] = (interactions, impressions, unique_impr)
+    for post_id, interactions, impressions in totals:
+        analytics_by_post[post_id] = (int(interactions), int(impressions), unique_by_post.get(post_id, 0))
 
     return analytics_by_post
 
 
+# Posts are listed this many at a time, in the order they were created, once a page is asked for
+POSTS_PAGE_SIZE = 100
+MAX_POSTS_PAGE_SIZE = 500
+
+
 """
 Endpoint: /portal/posts
 HTTP Methods: GET
 Response Formats: JSON
-Parameters: account
+Parameters: account, after, limit
 
-Returns list of posts
+Returns list of posts. Given after or limit, returns a page at a time instead; pass the "next" value
+of one page as after to get the next.
 """
 
 
 @app.route("/portal/posts", methods=["GET"])
 def get_posts():
     account_id = request.args.get("account")
-    posts = Post.query.filter_by(account=account_id).all()
-    posts_query = sqldb.session.query(Post.id).filter_by(account=account_id).subquery()
-
-    analytics_by_post = get_analytics(posts_query)
-
-    json_arr = []
-    for post in posts:
-        post_json = get_post_json(post)
-        post_json["organization"] = PostAccount.get_account(post_json["account"]).name
-        if str(post.id) in analytics_by_post:
-            (interactions, impressions, unique_impr) = analytics_by_post[str(post.id)]
-            post_json["interactions"] = interactions
-            post_json["impressions"] = impressions
-            post_json["unique_impressions"] = unique_impr
-        elif post.approved:
-            post_json["interactions"] = 0
-            post_json["impressions"] = 0
-            post_json["unique_impressions"] = 0
-        else:
-            post_json["interactions"] = None
-            post_json["impressions"] = None
-            post_json["unique_impressions"] = None
-        json_arr.append(post_json)
-    return jsonify({"posts": json_arr})
+    return get_posts_page(Post.query.filter_by(account=account_id))
 
 
 """
 Endpoint: /portal/posts/all
 HTTP Methods: GET
 Response Formats: JSON
-Parameters: account
+Parameters: account, after, limit
 
-Returns list of posts
+Returns list of posts. Given after or limit, returns a page at a time instead; pass the "next" value
+of one page as after to get the next.
 """
 
 
@@ -126,15 +106,35 @@ def get_all_posts():
     if account.email != "pennappslabs@gmail.com":
         return jsonify({"error": "Account not authorized to view all posts."}), 400
 
-    posts = Post.query.all()
-    posts_query = sqldb.session.query(Post.id).subquery()
+    return get_posts_page(Post.query)
 
-    analytics_by_post = get_analytics(posts_query)
 
-    json_arr = []
-    for post in posts:
-        post_json = get_post_json(post)
-        post_json["organization"] = PostAccount.get_account(post_json["account"]).name
+def get_posts_page(posts_query):
+    """Responds with the page of posts from posts_query that comes after the post with id `after`.
+
+    Pages are keyed on post id rather than an offset, so each page is a range scan on the primary
+    key however far into the list it is. Without after or limit, every post is returned, as before
+    pages were added.
+    """
+    try:
+        after = int(request.args.get("after", 0))
+        limit = max(1, min(int(request.args.get("limit", POSTS_PAGE_SIZE)), MAX_POSTS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid after or limit."}), 400
+
+    posts_query = posts_query.filter(Post.id > after).order_by(Post.id)
+    if "after" not in request.args and "limit" not in request.args:
+        posts = posts_query.all()
+        next_after = None
+    else:
+        posts = posts_query.limit(limit + 1).all()
+        next_after = posts[limit - 1].id if len(posts) > limit else None
+        posts = posts[:limit]
+
+    analytics_by_post = get_analytics([str(post.id) for post in posts]) if posts else {}
+
+    json_arr = get_posts_json(posts, organization=True)
+    for post, post_json in zip(posts, json_arr):
         if str(post.id) in analytics_by_post:
             (interactions, impressions, unique_impr) = analytics_by_post[str(post.id)]
             post_json["interactions"] = interactions
@@ -148,8 +148,7 @@ def get_all_posts():
             post_json["interactions"] = None
             post_json["impressions"] = None
             post_json["unique_impressions"] = None
-        json_arr.append(post_json)
-    return jsonify({"posts": json_arr})
+    return jsonify({"posts": json_arr, "next": next_after})
 
 
 """
@@ -174,37 +173,79 @@ def get_post(post_id):
 
 
 def get_post_json(post):
-    post_json = {
-        "id": post.id,
-        "account": post.account,
-        "source": post.source,
-        "title": post.title,
-        "subtitle": post.subtitle,
-        "time_label": post.time_label,
-        "image_url": post.image_url,
-        "image_url_cropped": post.image_url_cropped,
-        "post_url": post.post_url,
-        "approved": post.approved,
-        "start_date": datetime.strftime(post.start_date, "%Y-%m-%dT%H:%M:%S"),
-        "end_date": datetime.strftime(post.end_date, "%Y-%m-%dT%H:%M:%S"),
-        "filters": [],
-        "testers": [],
-        "emails": [],
-    }
-    filters = PostFilter.query.filter_by(post=post.id).all()
-    for obj in filters:
-        post_json["filters"].append({"type": obj.type, "filter": obj.filter})
-
-    testers = sqldb.session.query(PostTester.email).filter_by(post=post.id).all()
-    post_json["testers"] = [x for (x,) in testers]
-
-    emails = sqldb.session.query(PostTargetEmail.email).filter_by(post=post.id).all()
-    post_json["emails"] = [x for (x,) in emails]
+    return get_posts_json([post])[0]
+
+
+def get_posts_json(posts, organization=False):
+    """Returns the JSON for each of posts, in a fixed number of queries however many posts there are.
+
+    With organization=True, each post also gets the name of the account that created it.
+    """
+    post_ids = [post.id for post in posts]
+    if not post_ids:
+        return []
+
+    filters = {post_id: [] for post_id in post_ids}
+    for obj in PostFilter.query.filter(PostFilter.post.in_(post_ids)):
+        filters[obj.post].append({"type": obj.type, "filter": obj.filter})
+
+    testers = {post_id: [] for post_id in post_ids}
+    for post_id, email in sqldb.session.query(PostTester.post, PostTester.email).filter(
+        PostTester.post.in_(post_ids)
+    ):
+        testers[post_id].append(email)
+
+    emails = {post_id: [] for post_id in post_ids}
+    for post_id, email in sqldb.session.query(PostTargetEmail.post, PostTargetEmail.email).filter(
+        PostTargetEmail.post.in_(post_ids)
+    ):
+        emails[post_id].append(email)
+
+    # The latest status of each post
+    latest = (
+        sqldb.session.query(PostStatus.post, func.max(PostStatus.created_at).label("created_at"))
+        .filter(PostStatus.post.in_(post_ids))
+        .group_by(PostStatus.post)
+        .subquery()
+    )
+    statuses = {}
+    for status in PostStatus.query.join(
+        latest, and_(PostStatus.post == latest.c.post, PostStatus.created_at == latest.c.created_at)
+    ):
+        statuses.setdefault(status.post, status)
+
+    if organization:
+        account_ids = {post.account for post in posts}
+        names = dict(
+            sqldb.session.query(PostAccount.id, PostAccount.name).filter(PostAccount.id.in_(account_ids))
+        )
 
-    status = PostStatus.query.filter_by(post=post.id).order_by(desc(PostStatus.created_at)).first()
-    post_json["status"] = status.status
-    post_json["comments"] = status.msg
-    return post_json
+    json_arr = []
+    for post in posts:
+        post_json = {
+            "id": post.id,
+            "account": post.account,
+            "source": post.source,
+            "title": post.title,
+            "subtitle": post.subtitle,
+            "time_label": post.time_label,
+            "image_url": post.image_url,
+            "image_url_cropped": post.image_url_cropped,
+            "post_url": post.post_url,
+            "approved": post.approved,
+            "start_date": datetime.strftime(post.start_date, "%Y-%m-%dT%H:%M:%S"),
+            "end_date": datetime.strftime(post.end_date, "%Y-%m-%dT%H:%M:%S"),
+            "filters": filters[post.id],
+            "testers": testers[post.id],
+            "emails": emails[post.id],
+        }
+        status = statuses[post.id]
+        post_json["status"] = status.status
+        post_json["comments"] = status.msg
+        if organization:
+            post_json["organization"] = names[post.account]
+        json_arr.append(post_json)
+    return json_arr
 
 
 def get_posts_for_account(account):
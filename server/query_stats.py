@@ -0,0 +1,85 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from server import app
+
+
+logger = logging.getLogger(__name__)
+
+# A statement that runs more than this many times in one request is probably a query in a loop
+REPEATED_QUERY_THRESHOLD = int(os.environ.get("REPEATED_QUERY_THRESHOLD", 10))
+
+# Runs of placeholders, as in "IN (?, ?, ?)", which would otherwise make every list length its own statement
+PLACEHOLDERS = re.compile(r"(?:%s|\?|:\w+)(?:\s*,\s*(?:%s|\?|:\w+))+")
+
+
+class QueryStats(object):
+    """The SQL statements run while handling one request, and how long they took."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        # Requests that fan out share their stats with the threads they fan out to
+        self.lock = threading.Lock()
+
+    def record(self, statement, duration):
+        statement = PLACEHOLDERS.sub("?", statement)
+        with self.lock:
+            self.count += 1
+            self.duration += duration
+            self.statements[statement] += 1
+
+    def repeated(self, threshold=None):
+        """Returns (statement, times) for every statement that ran more than threshold times."""
+        threshold = REPEATED_QUERY_THRESHOLD if threshold is None else threshold
+        return [(statement, times) for statement, times in self.statements.most_common() if times > threshold]
+
+    def server_timing(self):
+        return 'db;dur=%.1f;desc="%d queries"' % (self.duration * 1000, self.count)
+
+
+def current():
+    """Returns the stats for the current request, or None outside of a request."""
+    return g.get("query_stats") if has_app_context() else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.time())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.time() - conn.info["query_start"].pop()
+    stats = current()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+@app.before_request
+def start_query_stats():
+    g.query_stats = QueryStats()
+
+
+@app.after_request
+def report_query_stats(response):
+    stats = current()
+    if stats is None:
+        return response
+
+    timing = response.headers.get("Server-Timing")
+    response.headers["Server-Timing"] = ", ".join(filter(None, [timing, stats.server_timing()]))
+
+    logger.info("%s %s: %d queries in %.1f ms", request.method, request.path, stats.count, stats.duration * 1000)
+    for statement, times in stats.repeated():
+        logger.warning("%s %s ran this statement %d times: %s", request.method, request.path, times, statement)
+    return response
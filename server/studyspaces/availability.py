@@ -70,13 +70,14 @@ def display_id_pairs():
     Returns JSON containing a list of buildings with their ids.
     """
 
-    def get_data():
-        return {
-            "locations": studyspaces.get_buildings()
-            + [{"lid": 1, "name": "Huntsman Hall", "service": "wharton"}]
-        }
+    return cached_route("studyspaces:locations", datetime.timedelta(days=1), get_locations)
 
-    return cached_route("studyspaces:locations", datetime.timedelta(days=1), get_data)
+
+def get_locations():
+    return {
+        "locations": studyspaces.get_buildings()
+        + [{"lid": 1, "name": "Huntsman Hall", "service": "wharton"}]
+    }
 
 
 def get_room_name(lid, rid):
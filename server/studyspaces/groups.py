@@ -2,6 +2,8 @@ import requests
 from flask import request
 from penn.base import APIError
 
+from server.http_client import http
+
 
 def get_invites_for_account(account, timeout=5):
     """
@@ -18,7 +20,7 @@ def get_invites_for_account(account, timeout=5):
     headers = {"Authorization": authorization if authorization else x_authorization}
     invite_url = "https://studentlife.pennlabs.org/users/me/invites"
     try:
-        r = requests.get(url=invite_url, headers=headers, timeout=timeout)
+        r = http.get(url=invite_url, headers=headers, timeout=timeout)
     except requests.exceptions.HTTPError as error:
         raise APIError("Server Error: {}".format(error))
     except requests.exceptions.ConnectTimeout:
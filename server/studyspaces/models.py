@@ -11,14 +11,20 @@ def get_est_date():
 
 
 class StudySpacesBooking(sqldb.Model):
+    __table_args__ = (
+        sqldb.Index(
+            "ix_study_spaces_booking_start_reminder_sent_is_cancelled", "start", "reminder_sent", "is_cancelled"
+        ),
+    )
+
     id = sqldb.Column(sqldb.Integer, primary_key=True)
     account = sqldb.Column(sqldb.VARCHAR(255), sqldb.ForeignKey("account.id"), nullable=True)
     user = sqldb.Column(sqldb.Integer, sqldb.ForeignKey("user.id"), nullable=True)
-    booking_id = sqldb.Column(sqldb.Text, nullable=True)
+    booking_id = sqldb.Column(sqldb.VARCHAR(255), nullable=True, index=True)
     date = sqldb.Column(sqldb.DateTime, default=get_est_date)
     lid = sqldb.Column(sqldb.Integer, nullable=True)
     rid = sqldb.Column(sqldb.Integer, nullable=True)
-    email = sqldb.Column(sqldb.Text, nullable=True)
+    email = sqldb.Column(sqldb.VARCHAR(255), nullable=True, index=True)
     start = sqldb.Column(sqldb.DateTime, nullable=True)
     end = sqldb.Column(sqldb.DateTime, nullable=True)
     is_cancelled = sqldb.Column(sqldb.Boolean, default=False)
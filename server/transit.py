@@ -2,11 +2,12 @@ import copy
 import datetime
 from functools import reduce
 
-import requests
 from flask import jsonify, request
+from pytz import timezone
 
 from server import app
 from server.base import cache_get, cached_route
+from server.http_client import http
 from server.penndata import transit
 from server.utils import haversine
 
@@ -15,12 +16,17 @@ def get_stop_info():
     return {"result_data": populate_stop_info(transit.stopinventory())}
 
 
+def stops_td():
+    """How long the stops are cached for: until the end of the day, Eastern time."""
+    est = timezone("EST")
+    now = datetime.datetime.now(est)
+    end_of_day = datetime.datetime(now.year, now.month, now.day, tzinfo=now.tzinfo) + datetime.timedelta(days=1)
+    return end_of_day - now
+
+
 @app.route("/transit/stops", methods=["GET"])
 def transit_stops():
-    now = datetime.datetime.today()
-    endDay = datetime.datetime(now.year, now.month, now.day) + datetime.timedelta(days=1)
-
-    return cached_route("transit:stops", endDay - now, get_stop_info)
+    return cached_route("transit:stops", stops_td(), get_stop_info, compress=True)
 
 
 @app.route("/transit/routes", methods=["GET"])
@@ -40,7 +46,10 @@ def transit_routes():
         return {"result_data": routes_with_directions(populate_route_info())}
 
     # cache lasts a month, since directions data is time intensive, and routes don't really change.
-    data = cached_route("transit:routes", datetime.timedelta(days=30), get_data)
+    # After that, the old routes are served for up to another month while they are refreshed.
+    td = datetime.timedelta(days=60)
+    soft_td = datetime.timedelta(days=30)
+    data = cached_route("transit:routes", td, get_data, soft_td=soft_td, compress=True)
     return data
 
 
@@ -56,7 +65,7 @@ def fastest_route():
         return {"result_data": routes_with_directions(populate_route_info())}
 
     # Retrieve routes, generating using get_data if necessary
-    route_data = cache_get("transit:routes", endDay - now, get_data)["result_data"]
+    route_data = cache_get("transit:routes", endDay - now, get_data, compress=True)["result_data"]
 
     latFrom, lonFrom = float(request.args["latFrom"]), float(request.args["lonFrom"])
     latTo, lonTo = float(request.args["latTo"]), float(request.args["lonTo"])
@@ -172,7 +181,7 @@ def routes_with_directions(route_data):
 
     for route in route_data:
         url = "http://www.pennrides.com/Route/%d/Waypoints/" % pennride_id[route["route_name"]]
-        r = requests.get(url)
+        r = http.get(url)
         all_waypoints = r.json()[0]
         i = 0
         for stop in route["stops"]:
@@ -216,7 +225,7 @@ def populate_route_info():
     removes the last stop on the Campus Loop, which appears to be incorrect.
     """
     # retrieve from cache, or generate and store in cache
-    stop_info = cache_get("transit:stops", datetime.timedelta(days=1), get_stop_info)
+    stop_info = cache_get("transit:stops", datetime.timedelta(days=1), get_stop_info, compress=True)
 
     routes = dict()
 
@@ -0,0 +1,124 @@
+import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from pytz import timezone
+
+from server import app, db, sentry
+from server.base import cache_get, cache_refresh
+from server.dining.hours_menus import get_menu_v2, menu_v2_key
+from server.laundry import USAGE_SOFT_TD, USAGE_TD, usage_data, usage_key
+from server.penndata import calendar, dinV2, laundry
+from server.studyspaces.availability import get_locations
+from server.transit import get_stop_info, stops_td
+
+
+# Keys are refreshed once they are within this long of expiring, so it should be longer than the
+# interval between warmer runs
+WARM_AHEAD = datetime.timedelta(minutes=30)
+
+# How many requests each upstream gets at once while warming
+UPSTREAM_CONCURRENCY = {"dining": 4, "laundry": 2, "transit": 1, "studyspaces": 1, "calendar": 1}
+
+# How many days of dining menus to keep warm, starting with today
+MENU_DAYS = 7
+
+WarmJob = namedtuple("WarmJob", ["upstream", "redis_key", "td", "func", "options"])
+
+
+def warm_jobs():
+    """Returns the hot keys that should always be cached, along with how to compute them."""
+    est = timezone("EST")
+    now = datetime.datetime.now(est)
+    jobs = []
+
+    # Menus can't be listed while dining is down, but every other key is still warmed
+    try:
+        venues = cache_get("dining:v2:venues", datetime.timedelta(days=1), lambda: dinV2.venues()["result_data"])
+        venues = venues["document"]["venue"]
+    except Exception:
+        sentry.captureException()
+        venues = []
+    for venue in venues:
+        for offset in range(MENU_DAYS):
+            date = str((now + datetime.timedelta(days=offset)).date())
+            jobs.append(
+                WarmJob(
+                    "dining",
+                    menu_v2_key(venue["id"], date),
+                    datetime.timedelta(days=1),
+                    _bind(get_menu_v2, venue["id"], date),
+                    {},
+                )
+            )
+
+    # Tomorrow's usage is warmed too, so the first check after midnight is already cached
+    for day in [now, now + datetime.timedelta(days=1)]:
+        for hall in laundry.hall_id_list:
+            args = (hall["id"], day.year, day.month, day.day)
+            jobs.append(
+                WarmJob(
+                    "laundry",
+                    usage_key(*args),
+                    USAGE_TD,
+                    _bind(usage_data, *args),
+                    {"soft_td": USAGE_SOFT_TD},
+                )
+            )
+
+    jobs.append(WarmJob("transit", "transit:stops", stops_td(), get_stop_info, {"compress": True}))
+    jobs.append(
+        WarmJob("studyspaces", "studyspaces:locations", datetime.timedelta(days=1), get_locations, {})
+    )
+    jobs.append(
+        WarmJob(
+            "calendar", "calendar:3year", datetime.timedelta(weeks=1), calendar.pull_3year, {"compress": True}
+        )
+    )
+    return jobs
+
+
+def _bind(func, *args):
+    return lambda: func(*args)
+
+
+def needs_warming(redis_key):
+    """Whether the key is missing, or will expire within WARM_AHEAD."""
+    ttl = db.pttl(redis_key)
+    return ttl < 0 or ttl < WARM_AHEAD.total_seconds() * 1000
+
+
+def warm(jobs=None):
+    """Refreshes every job whose key is about to expire, and returns the keys that were refreshed.
+
+    Each upstream gets its own pool, sized by UPSTREAM_CONCURRENCY, so a slow upstream can't hold up
+    the others or be sent more requests than it can handle.
+    """
+    if jobs is None:
+        jobs = warm_jobs()
+
+    by_upstream = {}
+    for job in jobs:
+        if needs_warming(job.redis_key):
+            by_upstream.setdefault(job.upstream, []).append(job)
+
+    pools = []
+    futures = []
+    for upstream, upstream_jobs in by_upstream.items():
+        pool = ThreadPoolExecutor(max_workers=UPSTREAM_CONCURRENCY.get(upstream, 1))
+        pools.append(pool)
+        futures.extend((job, pool.submit(_warm_one, job)) for job in upstream_jobs)
+
+    refreshed = [job.redis_key for job, future in futures if future.result()]
+    for pool in pools:
+        pool.shutdown()
+    return refreshed
+
+
+def _warm_one(job):
+    with app.app_context():
+        try:
+            return cache_refresh(job.redis_key, job.td, job.func, **job.options)
+        except Exception:
+            sentry.captureException()
+            return False
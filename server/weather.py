@@ -1,17 +1,16 @@
 import datetime
 import os
 
-import requests
-
 from server import app
 from server.base import cached_route
+from server.http_client import http
 
 
 @app.route("/weather", methods=["GET"])
 def retrieve_weather_data():
     """Retrieves the current weather from the Open Weather Map API.
     Stores data in a cache whenever data is retrieved; cache is updated
-    if it has not been updated within 10 minutes.
+    in the background if it has not been updated within 10 minutes.
     """
     OWM_API_KEY = os.getenv("OWM_API_KEY")
 
@@ -20,9 +19,10 @@ def retrieve_weather_data():
             "http://api.openweathermap.org/data/2.5/weather?q=Philadelphia&units=imperial&APPID=%s"
             % OWM_API_KEY
         )
-        json = requests.get(url).json()
+        json = http.get(url).json()
         return {"weather_data": json}
 
-    td = datetime.timedelta(seconds=600)
+    td = datetime.timedelta(hours=6)
+    soft_td = datetime.timedelta(seconds=600)
 
-    return cached_route("weather", td, get_data)
+    return cached_route("weather", td, get_data, soft_td=soft_td)
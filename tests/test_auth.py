@@ -0,0 +1,164 @@
+import json
+import time
+import unittest
+
+import jwt
+import mock
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import g
+from jwt.algorithms import RSAAlgorithm
+
+import server
+from server import db
+from server.auth import auth, introspection_cache, key_set
+from server.models import Account, sqldb
+
+
+def fakeIntrospect(url, headers=None, data=None):
+    if data["token"] == "valid":
+        return mock.MagicMock(status_code=200, json=lambda: {"user": {"pennid": 12345}, "exp": time.time() + 60})
+    return mock.MagicMock(status_code=401)
+
+
+@auth()
+def whoami():
+    return g.account.id
+
+
+class AuthTests(unittest.TestCase):
+    def setUp(self):
+        server.app.config["TESTING"] = True
+        introspection_cache.entries.clear()
+        for key in db.keys("auth:token:*"):
+            db.delete(key)
+
+    def call(self, token):
+        with server.app.test_request_context(headers={"Authorization": "Bearer %s" % token}):
+            return whoami()
+
+    def testCachesIntrospection(self):
+        with server.app.app_context():
+            account = Account(pennkey="authtest", pennid=12345, first="Auth")
+            sqldb.session.add(account)
+            sqldb.session.commit()
+            account_id = account.id
+
+        with mock.patch("server.auth.http.post", side_effect=fakeIntrospect) as post:
+            self.assertEquals(self.call("valid"), account_id)
+            self.assertEquals(self.call("valid"), account_id)
+            self.assertEquals(post.call_count, 1)
+
+            # Other processes find it in Redis
+            introspection_cache.entries.clear()
+            self.assertEquals(self.call("valid"), account_id)
+            self.assertEquals(post.call_count, 1)
+            self.assertTrue(0 < db.pttl(db.keys("auth:token:*")[0]) <= 60000)
+
+            # Invalid tokens are remembered too
+            self.assertEquals(self.call("invalid")[1], 401)
+            self.assertEquals(self.call("invalid")[1], 401)
+            self.assertEquals(post.call_count, 2)
+
+    def testPlatformErrorsArentCached(self):
+        unavailable = mock.MagicMock(status_code=503)
+        with mock.patch("server.auth.http.post", return_value=unavailable) as post:
+            self.assertEquals(self.call("valid")[1], 401)
+            self.assertEquals(self.call("valid")[1], 401)
+            self.assertEquals(post.call_count, 2)
+        self.assertEquals(db.keys("auth:token:*"), [])
+
+        # Once platform is back, the token works right away
+        with mock.patch("server.auth.http.post", side_effect=fakeIntrospect):
+            with server.app.app_context():
+                sqldb.session.add(Account(pennkey="blip", pennid=12345))
+                sqldb.session.commit()
+            self.assertTrue(self.call("valid"))
+
+    def testAccountColumnsLoadLazily(self):
+        with server.app.app_context():
+            account = Account(pennkey="lazytest", pennid=54321, first="Lazy")
+            sqldb.session.add(account)
+            sqldb.session.commit()
+
+        def fakeLazyIntrospect(url, headers=None, data=None):
+            return mock.MagicMock(status_code=200, json=lambda: {"user": {"pennid": 54321}})
+
+        @auth()
+        def first_name():
+            return g.account.first
+
+        with mock.patch("server.auth.http.post", side_effect=fakeLazyIntrospect):
+            with server.app.test_request_context(headers={"Authorization": "Bearer lazy"}):
+                self.assertEquals(first_name(), "Lazy")
+
+    def testVerifiesSignedTokensLocally(self):
+        with server.app.app_context():
+            account = Account(pennkey="jwttest", pennid=67890)
+            sqldb.session.add(account)
+            sqldb.session.commit()
+            account_id = account.id
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update({"kid": "test-key", "alg": "RS256"})
+        jwks = mock.MagicMock(status_code=200, json=lambda: {"keys": [jwk]})
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+        def sign(claims, key=private_key, kid="test-key"):
+            claims = dict({"pennid": 67890, "exp": int(time.time()) + 60}, **claims)
+            return jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid}).decode("utf8")
+
+        key_set.keys = {}
+        key_set.fetched_at = 0
+        with mock.patch("server.auth.JWKS_URL", "https://platform.example.com/jwks/"), mock.patch(
+            "server.auth.http.get", return_value=jwks
+        ) as get, mock.patch("server.auth.http.post", side_effect=fakeIntrospect) as post:
+            self.assertEquals(self.call(sign({})), account_id)
+            self.assertEquals(self.call(sign({"jti": "another"})), account_id)
+            self.assertEquals(get.call_count, 1)
+
+            # Expired tokens and bad signatures are rejected without asking platform
+            self.assertEquals(self.call(sign({"exp": int(time.time()) - 10}))[1], 401)
+            self.assertEquals(self.call(sign({}, key=other_key))[1], 401)
+            self.assertEquals(post.call_count, 0)
+
+            # Opaque tokens are still introspected
+            self.call("valid")
+            self.assertEquals(post.call_count, 1)
+
+    def testSkipsKeysItCantLoad(self):
+        with server.app.app_context():
+            account = Account(pennkey="jwkstest", pennid=13579)
+            sqldb.session.add(account)
+            sqldb.session.commit()
+            account_id = account.id
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update({"kid": "good-key", "alg": "RS256"})
+        ec_key = {"kty": "EC", "kid": "ec-key", "alg": "ES256", "crv": "P-256", "x": "AAAA", "y": "AAAA"}
+        bad_key = {"kty": "RSA", "kid": "bad-key", "alg": "RS256", "n": "not base64!"}
+        jwks = mock.MagicMock(status_code=200, json=lambda: {"keys": [ec_key, bad_key, jwk]})
+
+        def sign(claims):
+            return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "good-key"}).decode("utf8")
+
+        key_set.keys = {}
+        key_set.fetched_at = 0
+        with mock.patch("server.auth.JWKS_URL", "https://platform.example.com/jwks/"), mock.patch(
+            "server.auth.http.get", return_value=jwks
+        ):
+            self.assertEquals(self.call(sign({"pennid": 13579, "exp": int(time.time()) + 60})), account_id)
+
+            # Tokens that never expire are rejected
+            self.assertEquals(self.call(sign({"pennid": 13579}))[1], 401)
+
+        # A JWKS that isn't JSON is treated like platform being down
+        key_set.keys = {}
+        key_set.fetched_at = 0
+        with mock.patch("server.auth.JWKS_URL", "https://platform.example.com/jwks/"), mock.patch(
+            "server.auth.http.get", return_value=mock.MagicMock(json=mock.MagicMock(side_effect=ValueError))
+        ):
+            token = sign({"pennid": 13579, "exp": int(time.time()) + 60, "jti": "unverified"})
+            self.assertEquals(self.call(token)[1], 401)
@@ -0,0 +1,108 @@
+import json
+import unittest
+
+import mock
+from penn.base import APIError
+from requests.exceptions import ConnectionError, HTTPError
+
+import server
+from server import db, laundry_snapshot
+from server.base import cache_invalidate
+from server.breaker import FAILURE_THRESHOLD, CircuitBreaker
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+        self.hall_id_list = [1, 2]
+
+    def fetch(self, item):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("upstream is down")
+        if item < 0:
+            raise ValueError("bad item")
+        if item >= 1000:
+            raise APIError("Request to https://example.com/%d returned %d" % (item, item - 1000))
+        return item
+
+    def helper(self):
+        return "local"
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        server.app.config["TESTING"] = True
+        for key in db.keys("breaker:test:*") + db.keys("breaker:laundry:*"):
+            db.delete(key)
+        self.client = FakeClient()
+        self.breaker = CircuitBreaker(self.client, "test", APIError, local=["helper"])
+
+    def tearDown(self):
+        for key in db.keys("breaker:test:*") + db.keys("breaker:laundry:*"):
+            db.delete(key)
+
+    def testPassesThrough(self):
+        self.assertEquals(self.breaker.fetch(1), 1)
+        self.assertEquals(self.breaker.hall_id_list, [1, 2])
+        self.assertEquals(self.breaker.helper(), "local")
+
+        # Errors that aren't the upstream's fault don't count against it
+        for _ in range(FAILURE_THRESHOLD):
+            with self.assertRaises(ValueError):
+                self.breaker.fetch(-1)
+        self.assertEquals(self.breaker.fetch(2), 2)
+
+        # Neither are 4xx responses
+        for _ in range(FAILURE_THRESHOLD):
+            with self.assertRaises(APIError):
+                self.breaker.fetch(1404)
+        self.assertEquals(self.breaker.fetch(2), 2)
+
+    def testOpensAfterServerErrors(self):
+        for item in range(1500, 1500 + FAILURE_THRESHOLD):
+            with self.assertRaises(APIError):
+                self.breaker.fetch(item)
+        self.assertTrue(db.exists("breaker:test:open"))
+
+    def testOpensAfterRepeatedFailures(self):
+        self.client.down = True
+        for item in range(FAILURE_THRESHOLD):
+            with self.assertRaises(ConnectionError):
+                self.breaker.fetch(item)
+        self.assertEquals(self.client.calls, FAILURE_THRESHOLD)
+
+        # The upstream isn't called at all while the breaker is open
+        self.client.down = False
+        with self.assertRaises(APIError):
+            self.breaker.fetch(100)
+        self.assertEquals(self.client.calls, FAILURE_THRESHOLD)
+
+        # Once it closes again, a single failure is enough to reopen it
+        db.delete("breaker:test:open")
+        self.client.down = True
+        with self.assertRaises(ConnectionError):
+            self.breaker.fetch(101)
+        self.assertTrue(db.exists("breaker:test:open"))
+
+    def testRemembersFailedCalls(self):
+        self.client.down = True
+        with self.assertRaises(ConnectionError):
+            self.breaker.fetch(1)
+        self.client.down = False
+        with self.assertRaises(APIError):
+            self.breaker.fetch(1)
+        self.assertEquals(self.breaker.fetch(2), 2)
+        self.assertEquals(self.client.calls, 2)
+
+    def testLaundryFailsFast(self):
+        db.set("breaker:laundry:open", 1, px=60000)
+        cache_invalidate(laundry_snapshot.SNAPSHOT_KEY)
+        with mock.patch("penn.laundry.requests.get", side_effect=AssertionError("called upstream")):
+            with server.app.test_client() as c:
+                resp = c.get("/laundry/halls")
+        self.assertTrue(isinstance(server.penndata.laundry.error("x"), HTTPError))
+        self.assertEquals(
+            json.loads(resp.data.decode("utf8")), {"error": "The laundry api is currently unavailable."}
+        )
@@ -0,0 +1,326 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+import unittest
+
+import mock
+
+import server
+from server import db
+from server.base import (CacheEntry, cache_get, cache_get_many, cache_invalidate,
+                         cache_refresh, cached_route, local_cache)
+from server.metrics import METRICS_KEY, metrics
+from server.warmer import WarmJob, warm, warm_jobs
+
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        server.app.config["TESTING"] = True
+        for key in db.keys("test:*") + db.keys("lock:test:*"):
+            db.delete(key)
+
+    def testCacheGetStoresValue(self):
+        calls = []
+
+        def get_data():
+            calls.append(1)
+            return {"value": 1}
+
+        td = datetime.timedelta(minutes=1)
+        self.assertEquals(cache_get("test:store", td, get_data), {"value": 1})
+        self.assertEquals(cache_get("test:store", td, get_data), {"value": 1})
+        self.assertEquals(len(calls), 1)
+        self.assertTrue(0 < db.ttl("test:store") <= 60)
+        self.assertFalse(db.exists("lock:test:store"))
+
+    def testCacheGetSingleFlight(self):
+        calls = []
+        results = []
+
+        def get_data():
+            calls.append(1)
+            time.sleep(0.3)
+            return {"value": len(calls)}
+
+        def worker():
+            results.append(cache_get("test:single_flight", datetime.timedelta(minutes=1), get_data))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(results, [{"value": 1}] * 5)
+
+    def testCacheGetReleasesLockOnError(self):
+        def get_data():
+            raise ValueError("upstream is down")
+
+        with self.assertRaises(ValueError):
+            cache_get("test:error", datetime.timedelta(minutes=1), get_data)
+        self.assertFalse(db.exists("lock:test:error"))
+        self.assertFalse(db.exists("test:error"))
+
+    def testCacheGetDoesNotOverwriteLockHolder(self):
+        # Another caller holds the lock and never finishes; we compute the value ourselves but
+        # leave storing it to the lock holder.
+        db.set("lock:test:held", "someone-else", px=60000)
+        with mock.patch("server.base.LOCK_WAIT", datetime.timedelta(seconds=0.2)):
+            data = cache_get("test:held", datetime.timedelta(minutes=1), lambda: {"value": 2})
+        self.assertEquals(data, {"value": 2})
+        self.assertFalse(db.exists("test:held"))
+        self.assertEquals(db.get("lock:test:held"), b"someone-else")
+
+    def testCacheGetStaleWhileRevalidate(self):
+        calls = []
+
+        def get_data():
+            calls.append(1)
+            return {"value": len(calls)}
+
+        td = datetime.timedelta(minutes=1)
+        soft_td = datetime.timedelta(seconds=0.2)
+        self.assertEquals(cache_get("test:swr", td, get_data, soft_td=soft_td), {"value": 1})
+        time.sleep(0.3)
+
+        # The stale value is returned immediately, and refreshed in the background
+        self.assertEquals(cache_get("test:swr", td, get_data, soft_td=soft_td), {"value": 1})
+        server.base.refresh_executor.submit(lambda: None).result()
+        for _ in range(20):
+            if len(calls) == 2 and not db.exists("lock:test:swr"):
+                break
+            time.sleep(0.05)
+        self.assertEquals(cache_get("test:swr", td, get_data, soft_td=soft_td), {"value": 2})
+        self.assertEquals(len(calls), 2)
+
+    def testCacheGetReadsLegacyEntries(self):
+        db.set("test:legacy", json.dumps({"value": "old"}), ex=60)
+        self.assertEquals(
+            cache_get("test:legacy", datetime.timedelta(minutes=1), lambda: None), {"value": "old"}
+        )
+
+    def testCachedRouteMaxAgeUsesSoftTTL(self):
+        with server.app.test_request_context():
+            resp = cached_route(
+                "test:route",
+                datetime.timedelta(hours=1),
+                lambda: {"value": 1},
+                soft_td=datetime.timedelta(minutes=10),
+            )
+        self.assertEquals(json.loads(resp.data.decode("utf8")), {"value": 1})
+        max_age = int(resp.headers["Cache-Control"].split("=")[1])
+        self.assertTrue(590 <= max_age <= 600)
+
+    def waitForLocalCache(self):
+        local_cache.get("test:warmup")
+        for _ in range(40):
+            if local_cache.listening:
+                return
+            time.sleep(0.05)
+        self.fail("local cache never subscribed to invalidations")
+
+    def testLocalCacheServesWithoutRedis(self):
+        self.waitForLocalCache()
+        td = datetime.timedelta(minutes=1)
+        self.assertEquals(cache_get("test:local", td, lambda: {"value": 1}, local=True), {"value": 1})
+
+        # Going around cache_get doesn't notify anyone, so this process keeps its own copy
+        db.set("test:local", json.dumps({"value": 2}))
+        with mock.patch("server.base.db.get", side_effect=AssertionError("went to redis")):
+            self.assertEquals(cache_get("test:local", td, lambda: None, local=True), {"value": 1})
+
+        # A write announced by another process drops the local copy
+        db.publish(server.base.INVALIDATION_CHANNEL, "otherhost:1 test:local")
+        for _ in range(40):
+            if "test:local" not in local_cache.entries:
+                break
+            time.sleep(0.05)
+        self.assertEquals(cache_get("test:local", td, lambda: None, local=True), {"value": 2})
+
+    def testLocalCacheEvictsLeastRecentlyUsed(self):
+        self.waitForLocalCache()
+        td = datetime.timedelta(minutes=1)
+        size = len(CacheEntry.create("x" * 100, td).body)
+        # Room for two entries, but not three
+        with mock.patch.object(local_cache, "max_bytes", size * 2 + size // 2):
+            cache_get("test:lru1", td, lambda: "x" * 100, local=True)
+            cache_get("test:lru2", td, lambda: "x" * 100, local=True)
+            cache_get("test:lru1", td, lambda: None, local=True)
+            cache_get("test:lru3", td, lambda: "x" * 100, local=True)
+            self.assertTrue("test:lru1" in local_cache.entries)
+            self.assertFalse("test:lru2" in local_cache.entries)
+            self.assertTrue("test:lru3" in local_cache.entries)
+            self.assertTrue(local_cache.size <= local_cache.max_bytes)
+        local_cache.clear()
+
+    def testCacheInvalidate(self):
+        self.waitForLocalCache()
+        td = datetime.timedelta(minutes=1)
+        cache_get("test:invalidate", td, lambda: {"value": 1}, local=True)
+        cache_invalidate("test:invalidate")
+        self.assertFalse(db.exists("test:invalidate"))
+        self.assertEquals(
+            cache_get("test:invalidate", td, lambda: {"value": 2}, local=True), {"value": 2}
+        )
+
+    def testCachedRouteSendsStoredBody(self):
+        td = datetime.timedelta(minutes=1)
+        db.set("test:body", CacheEntry({"expires": time.time() + 60}, b'{"value":[1,2]}').serialize())
+        with server.app.test_request_context():
+            resp = cached_route("test:body", td, lambda: None)
+        self.assertEquals(resp.data, b'{"value":[1,2]}')
+        self.assertEquals(resp.mimetype, "application/json")
+
+    def testCachedRouteGzip(self):
+        td = datetime.timedelta(minutes=1)
+        data = {"value": "x" * 2000}
+        with server.app.test_request_context(headers={"Accept-Encoding": "gzip, deflate"}):
+            resp = cached_route("test:gzip", td, lambda: data)
+        self.assertEquals(resp.headers["Content-Encoding"], "gzip")
+        self.assertEquals(json.loads(gzip.decompress(resp.data).decode("utf8")), data)
+
+        with server.app.test_request_context():
+            resp = cached_route("test:gzip", td, lambda: None)
+        self.assertFalse("Content-Encoding" in resp.headers)
+        self.assertEquals(json.loads(resp.data.decode("utf8")), data)
+
+    def testCachedRouteETag(self):
+        td = datetime.timedelta(minutes=1)
+        with server.app.test_request_context():
+            resp = cached_route("test:etag", td, lambda: {"value": 1})
+        etag = resp.headers["ETag"]
+        self.assertEquals(resp.status_code, 200)
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertTrue("max-age" in resp.headers["Cache-Control"])
+
+        with server.app.test_request_context(headers={"If-None-Match": etag}):
+            resp = cached_route("test:etag", td, lambda: None)
+        self.assertEquals(resp.status_code, 304)
+        self.assertEquals(resp.data, b"")
+        self.assertEquals(resp.headers["ETag"], etag)
+        self.assertTrue("max-age" in resp.headers["Cache-Control"])
+
+        # Once the value changes, so does the ETag
+        cache_invalidate("test:etag")
+        with server.app.test_request_context(headers={"If-None-Match": etag}):
+            resp = cached_route("test:etag", td, lambda: {"value": 2})
+        self.assertEquals(resp.status_code, 200)
+        self.assertNotEquals(resp.headers["ETag"], etag)
+
+    def testCacheGetMany(self):
+        td = datetime.timedelta(minutes=1)
+        cache_get("test:many:1", td, lambda: {"value": 1})
+        calls = []
+
+        def get_data(keys):
+            calls.append(keys)
+            return {key: {"value": key} for key in keys}
+
+        values = cache_get_many(["test:many:1", "test:many:2", "test:many:3"], td, get_data)
+        self.assertEquals(calls, [["test:many:2", "test:many:3"]])
+        self.assertEquals(values["test:many:1"], {"value": 1})
+        self.assertEquals(values["test:many:2"], {"value": "test:many:2"})
+        self.assertTrue(0 < db.ttl("test:many:3") <= 60)
+
+        # Everything is cached now, so the loader isn't called again
+        values = cache_get_many(["test:many:1", "test:many:2", "test:many:3"], td, get_data)
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(cache_get("test:many:3", td, lambda: None), {"value": "test:many:3"})
+
+        # Values the loader doesn't have aren't cached
+        values = cache_get_many(["test:many:1", "test:many:4"], td, lambda keys: {})
+        self.assertEquals(values, {"test:many:1": {"value": 1}})
+        self.assertFalse(db.exists("test:many:4"))
+
+    def testCacheGetCompressed(self):
+        td = datetime.timedelta(minutes=1)
+        data = {"stops": [{"name": "stop %d" % x, "order": x} for x in range(2000)]}
+        self.assertEquals(cache_get("test:compressed", td, lambda: data, compress=True), data)
+        self.assertTrue(db.strlen("test:compressed") < len(json.dumps(data)) / 4)
+        self.assertEquals(cache_get("test:compressed", td, lambda: None), data)
+
+        # The stored gzipped body is sent to clients as is
+        stored = CacheEntry.parse(db.get("test:compressed"))
+        with server.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            resp = cached_route("test:compressed", td, lambda: None, compress=True)
+        self.assertEquals(resp.data, stored.gzipped())
+        self.assertEquals(json.loads(gzip.decompress(resp.data).decode("utf8")), data)
+
+        # Small values aren't worth compressing
+        cache_get("test:uncompressed", td, lambda: {"value": 1}, compress=True)
+        self.assertFalse(CacheEntry.parse(db.get("test:uncompressed")).compressed)
+
+    def testCacheRefresh(self):
+        td = datetime.timedelta(minutes=1)
+        cache_get("test:refresh", td, lambda: {"value": 1})
+        self.assertTrue(cache_refresh("test:refresh", td, lambda: {"value": 2}))
+        self.assertEquals(cache_get("test:refresh", td, lambda: None), {"value": 2})
+
+        # Someone else is already recomputing the value
+        db.set("lock:test:refresh", "someone-else", px=60000)
+        self.assertFalse(cache_refresh("test:refresh", td, lambda: {"value": 3}))
+        self.assertEquals(cache_get("test:refresh", td, lambda: None), {"value": 2})
+
+    def testWarmRefreshesExpiringKeys(self):
+        calls = []
+
+        def get_data(value):
+            calls.append(value)
+            time.sleep(0.1)
+            return {"value": value}
+
+        td = datetime.timedelta(hours=1)
+        cache_get("test:warm:fresh", td, lambda: {"value": "cached"})
+        cache_get("test:warm:expiring", datetime.timedelta(minutes=1), lambda: {"value": "cached"})
+        jobs = [
+            WarmJob("test", "test:warm:fresh", td, lambda: get_data("fresh"), {}),
+            WarmJob("test", "test:warm:expiring", td, lambda: get_data("expiring"), {}),
+            WarmJob("test", "test:warm:missing", td, lambda: get_data("missing"), {}),
+            WarmJob("other", "test:warm:broken", td, mock.Mock(side_effect=ValueError), {}),
+        ]
+        with mock.patch("server.base.sentry.captureException") as capture:
+            refreshed = warm(jobs)
+        self.assertEquals(refreshed, ["test:warm:expiring", "test:warm:missing"])
+        self.assertEquals(calls, ["expiring", "missing"])
+        self.assertEquals(capture.call_count, 1)
+        self.assertEquals(cache_get("test:warm:expiring", td, lambda: None), {"value": "expiring"})
+        self.assertTrue(db.ttl("test:warm:missing") > 3500)
+
+    def testWarmJobsWithoutDining(self):
+        laundry = mock.Mock(hall_id_list=[{"id": 1}])
+        with mock.patch("server.warmer.cache_get", side_effect=ValueError("dining is down")), mock.patch(
+            "server.warmer.laundry", laundry
+        ), mock.patch("server.warmer.sentry.captureException") as capture:
+            jobs = warm_jobs()
+        self.assertEquals(capture.call_count, 1)
+        self.assertEquals(
+            sorted({job.upstream for job in jobs}), ["calendar", "laundry", "studyspaces", "transit"]
+        )
+        stops = [job for job in jobs if job.redis_key == "transit:stops"][0]
+        self.assertTrue(stops.td <= datetime.timedelta(days=1))
+
+    def testCacheMetrics(self):
+        metrics.flush()
+        db.delete(METRICS_KEY)
+        td = datetime.timedelta(minutes=1)
+        cache_get("test:metrics", td, lambda: {"value": 1})
+        cache_get("test:metrics", td, lambda: None)
+        with self.assertRaises(ValueError):
+            cache_get("test:metrics:error", td, mock.Mock(side_effect=ValueError))
+
+        client = server.app.test_client()
+        self.assertEquals(client.get("/metrics").status_code, 401)
+        with mock.patch.dict(os.environ, {"AUTH_SECRET": "secret"}):
+            resp = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        lines = resp.data.decode("utf8").splitlines()
+        self.assertTrue("# TYPE cache_hits_total counter" in lines)
+        self.assertTrue('cache_hits_total{namespace="test",tier="redis"} 1' in lines)
+        self.assertTrue('cache_misses_total{namespace="test"} 2' in lines)
+        self.assertTrue('cache_errors_total{namespace="test"} 1' in lines)
+        self.assertTrue('cache_load_seconds_count{namespace="test"} 2' in lines)
+        self.assertTrue('cache_value_bytes_sum{namespace="test"} 11' in lines)
@@ -2,7 +2,10 @@ import datetime
 import json
 import unittest
 
+import mock
+
 import server
+from server import db
 from server.models import Account, DiningBalance, sqldb
 
 
@@ -44,6 +47,24 @@ class DiningApiTests(unittest.TestCase):
                 "tomato tzatziki sauce and pita", item_dict["items"]["3899220"]["label"]
             )
 
+    def testDiningV2ItemsSkipsMissing(self):
+        for key in db.keys("dining:v2:items:test-*"):
+            db.delete(key)
+        result = {"result_data": {"items": {"test-1": {"label": "pita"}}}}
+        with mock.patch("server.dining.hours_menus.dinV2.item", return_value=result) as item:
+            items = server.dining.hours_menus.retrieve_items_v2(["test-1", "test-2"])
+            self.assertEquals(items, {"test-1": {"label": "pita"}, "test-2": None})
+            server.dining.hours_menus.retrieve_items_v2(["test-1", "test-2"])
+        self.assertEquals([call[0][0] for call in item.call_args_list], ["test-1,test-2", "test-2"])
+
+        # The route sends what the upstream would have, with the usual caching headers
+        with mock.patch("server.dining.hours_menus.dinV2.item", return_value=result):
+            with server.app.test_client() as c:
+                resp = c.get("/dining/v2/item/test-1,test-2")
+        self.assertEquals(json.loads(resp.data.decode("utf8")), {"items": {"test-1": {"label": "pita"}}})
+        self.assertTrue(resp.headers["ETag"])
+        self.assertTrue(resp.headers["Cache-Control"].startswith("max-age="))
+
     def testDiningWeeklyMenu(self):
         with server.app.test_request_context():
             menu_res = server.dining.hours_menus.retrieve_weekly_menu("593")
@@ -0,0 +1,59 @@
+import unittest
+from http.client import HTTPMessage
+
+import mock
+import penn.base
+import penn.laundry
+import requests
+
+import server  # noqa
+from server.http_client import DEFAULT_TIMEOUT, POOL_SIZES, PooledRequests, http
+
+
+class HttpClientTests(unittest.TestCase):
+    def testReusesSession(self):
+        client = PooledRequests()
+        self.assertTrue(client.session is client.session)
+        self.assertTrue(client.exceptions is requests.exceptions)
+
+        # A forked worker gets a session of its own
+        session = client.session
+        with mock.patch("server.http_client.os.getpid", return_value=-1):
+            self.assertFalse(client.session is session)
+
+    def testPoolSizes(self):
+        session = PooledRequests().session
+        host = next(iter(POOL_SIZES))
+        adapter = session.get_adapter("https://%s/page" % host)
+        self.assertEquals(adapter._pool_maxsize, POOL_SIZES[host])
+        self.assertTrue(adapter.max_retries.total > 0)
+
+    def testDefaultTimeout(self):
+        client = PooledRequests()
+        with mock.patch.object(client.session, "request") as request:
+            client.get("https://example.com")
+            client.get("https://example.com", timeout=1)
+        self.assertEquals(request.call_args_list[0][1]["timeout"], DEFAULT_TIMEOUT)
+        self.assertEquals(request.call_args_list[1][1]["timeout"], 1)
+
+    def testPennSDKUsesPool(self):
+        self.assertTrue(penn.laundry.requests is http)
+        self.assertEquals(penn.base.get, http.get)
+
+    def testDoesNotKeepCookies(self):
+        headers = HTTPMessage()
+        headers["Set-Cookie"] = "sessionid=secret; Path=/"
+        response = mock.Mock(_original_response=mock.Mock(msg=headers))
+        request = requests.Request("GET", "https://apps.wharton.upenn.edu/gsr/").prepare()
+
+        plain = requests.Session()
+        requests.cookies.extract_cookies_to_jar(plain.cookies, request, response)
+        self.assertEquals(len(plain.cookies), 1)
+
+        session = PooledRequests().session
+        requests.cookies.extract_cookies_to_jar(session.cookies, request, response)
+        self.assertEquals(len(session.cookies), 0)
+
+        # Cookies passed with a request are still sent
+        prepared = session.prepare_request(requests.Request("GET", request.url, cookies={"sessionid": "mine"}))
+        self.assertEquals(prepared.headers["Cookie"], "sessionid=mine")
@@ -0,0 +1,88 @@
+import datetime
+import unittest
+
+from sqlalchemy import not_
+
+import server
+from server.models import (DiningBalance, DiningPreference, DiningTransaction,
+                           LaundryPreference, LaundrySnapshot, LaundryUsage, User, sqldb)
+from server.portal.posts import analytics_query
+from server.studyspaces.models import StudySpacesBooking
+
+
+class IndexTests(unittest.TestCase):
+    """Checks that the queries on hot paths are answered from an index rather than a table scan."""
+
+    def setUp(self):
+        server.app.config["TESTING"] = True
+        self.context = server.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def assertUsesIndex(self, query, index):
+        compiled = query.statement.compile(dialect=sqldb.engine.dialect)
+        params = tuple(compiled.params[key] for key in compiled.positiontup)
+        if sqldb.engine.dialect.name == "sqlite":
+            plan = [row[-1] for row in sqldb.engine.execute("EXPLAIN QUERY PLAN " + str(compiled), params)]
+            self.assertTrue(any(("INDEX %s " % index) in step for step in plan), plan)
+        elif sqldb.engine.dialect.name == "mysql":
+            # MySQL may still scan tables as small as the test ones, so check that the index is one
+            # it would consider
+            plan = list(sqldb.engine.execute("EXPLAIN " + str(compiled), params))
+            keys = [set([row["key"]] + (row["possible_keys"] or "").split(",")) for row in plan]
+            self.assertTrue(any(index in step for step in keys), keys)
+        else:
+            self.skipTest("Query plans can't be checked on %s" % sqldb.engine.dialect.name)
+
+    def primaryKey(self, table):
+        if sqldb.engine.dialect.name == "mysql":
+            return "PRIMARY"
+        return "sqlite_autoindex_%s_1" % table
+
+    def testLaundryUsage(self):
+        query = LaundryUsage.query.filter(
+            (LaundryUsage.room == 1)
+            & LaundryUsage.day_of_week.in_([1, 2])
+            & (LaundryUsage.date >= datetime.date(2017, 1, 1))
+        )
+        self.assertUsesIndex(query, self.primaryKey("laundry_usage"))
+        query = LaundrySnapshot.query.filter(
+            (LaundrySnapshot.room == 1) & (LaundrySnapshot.date == datetime.date(2017, 1, 1))
+        )
+        self.assertUsesIndex(query, "ix_laundry_snapshot_room_date_time")
+
+    def testPreferences(self):
+        self.assertUsesIndex(User.query.filter_by(device_id="testing"), "ix_user_device_id")
+        self.assertUsesIndex(LaundryPreference.query.filter_by(user_id=1), "ix_laundry_preference_user_id")
+        self.assertUsesIndex(DiningPreference.query.filter_by(user_id=1), "ix_dining_preference_user_id")
+
+    def testDining(self):
+        self.assertUsesIndex(
+            DiningBalance.query.filter_by(account_id="account").order_by(DiningBalance.created_at.desc()),
+            "ix_dining_balance_account_id_created_at",
+        )
+        self.assertUsesIndex(
+            sqldb.session.query(DiningTransaction.date)
+            .filter_by(account_id="account")
+            .order_by(DiningTransaction.date.desc()),
+            "ix_dining_transaction_account_id_date",
+        )
+
+    def testStudySpaces(self):
+        now = datetime.datetime.now()
+        self.assertUsesIndex(
+            StudySpacesBooking.query.filter(StudySpacesBooking.start <= now + datetime.timedelta(minutes=10))
+            .filter(StudySpacesBooking.start > now)
+            .filter(not_(StudySpacesBooking.is_cancelled))
+            .filter(not_(StudySpacesBooking.reminder_sent)),
+            "ix_study_spaces_booking_start_reminder_sent_is_cancelled",
+        )
+        self.assertUsesIndex(
+            StudySpacesBooking.query.filter_by(booking_id="booking"), "ix_study_spaces_booking_booking_id"
+        )
+        self.assertUsesIndex(StudySpacesBooking.query.filter_by(email="a@upenn.edu"), "ix_study_spaces_booking_email")
+
+    def testPostAnalytics(self):
+        self.assertUsesIndex(analytics_query(["1", "2"]), "ix_analytics_event_type_post_id_is_interaction")
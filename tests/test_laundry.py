@@ -1,17 +1,35 @@
+import csv
 import datetime
+import gzip
+import io
 import json
+import os
+import tempfile
+import time
 import unittest
+from concurrent import futures
 
 import mock
+from flask import g
+from pytz import timezone
+from requests.exceptions import HTTPError
 
 import server
-from server.models import LaundrySnapshot, sqldb
+from server import db, laundry_snapshot
+from server.base import cache_invalidate
+from server.models import LaundrySnapshot, LaundryUsage, User, sqldb
+from server.query_stats import QueryStats
 
 
 class LaundryApiTests(unittest.TestCase):
     def setUp(self):
         server.app.config["TESTING"] = True
 
+    def tearDown(self):
+        # Background cache refreshes share the test database's one connection, so none may outlive a test
+        executor, server.base.refresh_executor = server.base.refresh_executor, futures.ThreadPoolExecutor(2)
+        executor.shutdown()
+
     @classmethod
     def setUpClass(self):
         with server.app.test_request_context():
@@ -38,6 +56,18 @@ class LaundryApiTests(unittest.TestCase):
                 )
                 sqldb.session.add(item)
             sqldb.session.commit()
+        server.laundry.rebuild_usage()
+
+        # Scrape the fake laundry site once for the whole class, rather than in every test
+        self.snapshot_interval = mock.patch("server.laundry_snapshot.SNAPSHOT_INTERVAL", datetime.timedelta(days=1))
+        self.snapshot_interval.start()
+        cache_invalidate(laundry_snapshot.SNAPSHOT_KEY)
+        with mock.patch("penn.laundry.requests.get", self.fakeLaundryGet):
+            self.snapshot = laundry_snapshot.get_snapshot()
+
+    @classmethod
+    def tearDownClass(self):
+        self.snapshot_interval.stop()
 
     def fakeLaundryGet(url, *args, **kwargs):
         if "suds.kite.upenn.edu" in url:
@@ -60,12 +90,86 @@ class LaundryApiTests(unittest.TestCase):
                     self.assertTrue(info[t]["out_of_order"] >= 0)
                     self.assertTrue(info[t]["open"] >= 0)
 
-    @mock.patch("requests.get", fakeLaundryGet)
+    @mock.patch("penn.laundry.requests.get", fakeLaundryGet)
     def testLaundryOneHall(self):
         with server.app.test_request_context():
             res = json.loads(server.laundry.hall(26).data.decode("utf8"))
             self.assertEquals(res["hall_name"], "Harrison Floor 20")
 
+    @mock.patch("penn.laundry.requests.get", fakeLaundryGet)
+    def testLaundryTwoHalls(self):
+        with server.app.test_request_context():
+            res = json.loads(server.laundry.two_halls(26, 1).data.decode("utf8"))["halls"]
+            self.assertEquals(res[0]["hall_name"], "Harrison Floor 20")
+            self.assertEquals(len(res), 2)
+
+            res = json.loads(server.laundry.two_halls(26, 1000).data.decode("utf8"))
+            self.assertEquals(res, {"error": "Invalid hall id passed to server."})
+
+    def testLaundryRoomsDeadline(self):
+        def slowSnapshot():
+            time.sleep(0.5)
+            return self.snapshot
+
+        executor = server.laundry.fanout_executor
+        submitted = []
+
+        def submit(*args):
+            submitted.append(executor.submit(*args))
+            return submitted[-1]
+
+        with server.app.test_request_context():
+            with mock.patch("server.laundry_snapshot.get_snapshot", slowSnapshot), mock.patch(
+                "server.laundry.FANOUT_DEADLINE", datetime.timedelta(seconds=0.1)
+            ), mock.patch("server.laundry.fanout_executor", mock.Mock(submit=submit)):
+                res = json.loads(server.laundry.get_rooms("1,26").data.decode("utf8"))
+            self.assertEquals(res, {"error": "The laundry api is currently unavailable."})
+
+        # The abandoned calls keep running, and share the database connection with later tests
+        futures.wait(submitted)
+
+    def testLaundrySnapshot(self):
+        calls = []
+
+        def fakeScrape():
+            calls.append(1)
+            return dict(self.snapshot, version=len(calls))
+
+        cache_invalidate(laundry_snapshot.SNAPSHOT_KEY)
+        with mock.patch("server.laundry_snapshot.scrape", fakeScrape):
+            self.assertEquals(laundry_snapshot.get_snapshot()["version"], 1)
+            with server.app.test_request_context():
+                server.laundry.hall(26)
+                server.laundry.two_halls(26, 1)
+                server.laundry.all_halls()
+                server.laundry.get_rooms("1,26")
+            self.assertEquals(len(calls), 1)
+
+            # The next scrape gets a new version
+            cache_invalidate(laundry_snapshot.SNAPSHOT_KEY)
+            self.assertEquals(laundry_snapshot.get_snapshot()["version"], 2)
+
+    @mock.patch("penn.laundry.requests.get", fakeLaundryGet)
+    def testLaundrySnapshotWithoutOneHall(self):
+        parse_a_hall = server.penndata.laundry.parse_a_hall
+
+        def fakeParseAHall(name):
+            if name == "Harrison Floor 20":
+                raise HTTPError("room is down")
+            return parse_a_hall(name)
+
+        with mock.patch("server.laundry_snapshot.laundry.parse_a_hall", fakeParseAHall):
+            snapshot = laundry_snapshot.scrape()
+        self.assertEquals(len(snapshot["halls"]), len(self.snapshot["halls"]) - 1)
+        self.assertEquals(laundry_snapshot.hall_status(1, snapshot), self.snapshot["halls"]["1"])
+        with self.assertRaises(HTTPError):
+            laundry_snapshot.hall_status(26, snapshot)
+
+        # With every hall down there's no snapshot at all
+        with mock.patch("server.laundry_snapshot.laundry.parse_a_hall", side_effect=HTTPError("site is down")):
+            with self.assertRaises(HTTPError):
+                laundry_snapshot.scrape()
+
     def testLaundryUsage(self):
         with server.app.test_request_context():
             request = server.laundry.usage(20, 2017, 1, 1)
@@ -87,6 +191,163 @@ class LaundryApiTests(unittest.TestCase):
                 self.assertEquals(res["washer_data"][str(x)], 1.5)
                 self.assertEquals(res["dryer_data"][str(x)], 1.5)
 
+    def testLaundryUsageMany(self):
+        with server.app.test_request_context():
+            g.query_stats = QueryStats()
+            usages = server.laundry.usage_data_many([1, 2, 20], datetime.date(2017, 1, 1))
+            self.assertEquals(g.query_stats.count, 1)
+            for hall in [1, 2, 20]:
+                self.assertEquals(usages[hall], server.laundry.usage_data(hall, 2017, 1, 1))
+
+        with server.app.test_client() as c:
+            resp = json.loads(c.get("/laundry/usage").data.decode("utf8"))
+        self.assertEquals(len(resp["halls"]), len(self.snapshot["halls"]))
+        self.assertEquals(resp["halls"][0]["id"], 0)
+        self.assertEquals(len(resp["halls"][0]["washer_data"]), 27)
+
+    def testLaundryUsageProfiles(self):
+        sunday, monday = datetime.date(2017, 1, 1), datetime.date(2016, 12, 26)
+        rows = [
+            # room, day of week, date, hour, washers, dryers, total washers, total dryers, snapshots
+            (1, 6, sunday - datetime.timedelta(days=7), 5, 4, 0, 12, 12, 4),
+            (1, 0, monday, 1, 5, 5, 3, 3, 1),
+            (1, 0, monday, 10, 5, 5, 3, 3, 1),
+            (2, 6, sunday, 0, 2, 2, 2, 2, 1),
+            (1, 6, sunday, 5, 7, 2, 6, 6, 2),
+        ]
+        with server.app.app_context():
+            usages = server.laundry.usage_profiles([1, 2, 3], sunday, rows)
+
+        self.assertEquals(usages[1]["washer_data"][5], 2)
+        self.assertEquals(usages[1]["dryer_data"][5], 0.5)
+        self.assertEquals(usages[1]["washer_data"][25], 5)
+        self.assertEquals(usages[1]["washer_data"][10], 0)
+        self.assertEquals(usages[1]["total_number_of_washers"], 3)
+        self.assertEquals((usages[1]["start_date"], usages[1]["end_date"]), ("2016-12-25", "2017-01-01"))
+        self.assertEquals(usages[2]["washer_data"][0], 2)
+        self.assertEquals(usages[3]["washer_data"], {hour: 0 for hour in range(27)})
+        self.assertEquals((usages[3]["start_date"], usages[3]["day_of_week"]), ("2017-01-01", "Sunday"))
+
+    def testLaundryUsageRollup(self):
+        def usage_rows():
+            with server.app.app_context():
+                return sorted(
+                    (row.room, row.day_of_week, row.date, row.hour, row.washers, row.dryers, row.snapshots)
+                    for row in LaundryUsage.query.all()
+                )
+
+        db.delete(server.laundry.SAVED_VERSION_KEY)
+        with mock.patch("server.laundry.laundry_snapshot.get_snapshot", return_value=self.snapshot):
+            server.laundry.save_data()
+        rows = usage_rows()
+        saved = [datetime.date(2016, 12, 25), datetime.date(2017, 1, 1), datetime.date(2017, 2, 1)]
+        today = [row for row in rows if row[2] not in saved]
+        self.assertEquals(len(today), len(self.snapshot["halls"]))
+        self.assertEquals({row[-1] for row in today}, {1})
+
+        # The rollup kept up at ingest matches one built from scratch
+        server.laundry.rebuild_usage()
+        self.assertEquals(usage_rows(), rows)
+
+    def testLaundrySaveDataIdempotent(self):
+        now = datetime.datetime(2017, 2, 1, 10, 30, tzinfo=timezone("EST"))
+        date = now.date()
+
+        def saved():
+            with server.app.app_context():
+                snapshots = LaundrySnapshot.query.filter_by(date=date).count()
+                usage = [row.snapshots for row in LaundryUsage.query.filter_by(date=date)]
+            return snapshots, usage
+
+        def save(scraped_at, version):
+            snapshot = dict(self.snapshot, scraped_at=scraped_at.timestamp(), version=version)
+            with mock.patch("server.laundry.laundry_snapshot.get_snapshot", return_value=snapshot):
+                server.laundry.save_data()
+
+        db.delete(server.laundry.SAVED_VERSION_KEY)
+        halls = len(self.snapshot["halls"])
+        save(now, 1)
+        # Later runs that are served the same snapshot from the cache don't save it again
+        save(now, 1)
+        self.assertEquals(saved(), (halls, [1] * halls))
+
+        # A snapshot whose version was already saved isn't saved again at all
+        with server.app.app_context():
+            LaundrySnapshot.query.filter_by(date=date, room=1).delete()
+            sqldb.session.commit()
+        save(now, 1)
+        self.assertEquals(saved()[0], halls - 1)
+
+        # A run that finds only some halls saved for the minute adds the rest
+        save(now, 2)
+        self.assertEquals(saved(), (halls, [1] * halls))
+
+        save(now + datetime.timedelta(minutes=1), 3)
+        self.assertEquals(saved(), (2 * halls, [2] * halls))
+        self.assertEquals(db.get(server.laundry.SAVED_VERSION_KEY), b"3")
+
+    def testRetireSnapshots(self):
+        date = datetime.date(2016, 6, 1)
+        with server.app.app_context():
+            for x in range(0, 3 * 60, 30):
+                sqldb.session.add(
+                    LaundrySnapshot(
+                        date=date, time=x, room=2, washers=1, dryers=2, total_washers=3, total_dryers=3
+                    )
+                )
+            sqldb.session.commit()
+
+        def usage_rows():
+            with server.app.app_context():
+                return [(row.hour, row.washers, row.snapshots) for row in LaundryUsage.query.filter_by(date=date)]
+
+        now = datetime.datetime(2016, 8, 1)
+        archive = tempfile.mkdtemp()
+        with self.assertRaises(ValueError):
+            server.laundry.retire_snapshots(now)
+        with mock.patch("server.laundry.SNAPSHOT_DELETE_BATCH", 4):
+            self.assertEquals(server.laundry.retire_snapshots(now, archive), [date])
+
+        with gzip.open(os.path.join(archive, "laundry_snapshot", "2016-06-01.csv.gz"), "rt") as f:
+            rows = list(csv.reader(f))
+        self.assertEquals(rows[0], ["date", "time", "room", "washers", "dryers", "total_washers", "total_dryers"])
+        self.assertEquals(rows[1], ["2016-06-01", "0", "2", "1", "2", "3", "3"])
+        self.assertEquals(rows[2][:2], ["2016-06-01", "30"])
+        self.assertEquals(len(rows), 7)
+
+        # The hourly totals outlive the snapshots, and survive a rebuild
+        with server.app.app_context():
+            self.assertEquals(LaundrySnapshot.query.filter_by(date=date).count(), 0)
+        self.assertEquals(usage_rows(), [(0, 2, 2), (1, 2, 2), (2, 2, 2)])
+        server.laundry.rebuild_usage()
+        self.assertEquals(usage_rows(), [(0, 2, 2), (1, 2, 2), (2, 2, 2)])
+        self.assertEquals(server.laundry.retire_snapshots(now, archive), [])
+
+    def testArchiveSnapshotsToS3(self):
+        date = datetime.date(2016, 6, 2)
+        with server.app.app_context():
+            sqldb.session.add(
+                LaundrySnapshot(date=date, time=0, room=2, washers=1, dryers=2, total_washers=3, total_dryers=3)
+            )
+            sqldb.session.commit()
+
+            with mock.patch("server.laundry.s3") as s3:
+                s3.list_objects_v2.return_value = {"KeyCount": 0}
+                server.laundry.archive_snapshots("s3://labs.api/archive/", date)
+                kwargs = s3.put_object.call_args[1]
+                self.assertEquals(kwargs["Bucket"], "labs.api")
+                self.assertEquals(kwargs["Key"], "archive/laundry_snapshot/2016-06-02.csv.gz")
+                self.assertEquals(kwargs["ACL"], "private")
+                self.assertEquals(len(gzip.GzipFile(fileobj=io.BytesIO(kwargs["Body"])).read().splitlines()), 2)
+
+                # Archives already written aren't replaced
+                s3.list_objects_v2.return_value = {"KeyCount": 1}
+                server.laundry.archive_snapshots("s3://labs.api/archive/", date)
+                self.assertEquals(s3.put_object.call_count, 1)
+
+            LaundrySnapshot.query.filter_by(date=date).delete()
+            sqldb.session.commit()
+
     def testLaundryPreferences(self):
         with server.app.test_client() as c:
             resp = json.loads(
@@ -108,3 +369,50 @@ class LaundryApiTests(unittest.TestCase):
                 )
             )
             self.assertEquals(resp["rooms"], [1, 2, 3])
+
+    def testLaundryPreferencesReadOnly(self):
+        with server.app.test_client() as c:
+            resp = json.loads(c.get("/laundry/preferences", headers={"X-Device-ID": "reader"}).data.decode("utf8"))
+            self.assertEquals(resp["rooms"], [])
+            resp = json.loads(c.get("/laundry/preferences", headers={"X-Device-ID": "x" * 256}).data.decode("utf8"))
+            self.assertEquals(resp["rooms"], [])
+
+        with server.app.app_context():
+            self.assertEquals(User.query.filter_by(device_id="reader").count(), 0)
+
+    def testUserResolvedFromCache(self):
+        with server.app.test_client() as c:
+            headers = {"X-Device-ID": "cached", "User-Agent": "iPhone"}
+            c.post("/laundry/preferences", headers=headers, data={"rooms": "4"})
+
+            # Known devices are loaded by primary key rather than through the device_id index
+            with mock.patch.object(User.query, "filter_by", side_effect=AssertionError("looked up device id")):
+                resp = c.get("/laundry/preferences", headers={"X-Device-ID": "cached"})
+            self.assertEquals(json.loads(resp.data.decode("utf8"))["rooms"], [4])
+
+        with server.app.test_request_context(headers={"X-Device-ID": "cached"}):
+            self.assertEquals(User.get_user().platform, "ios")
+
+    def testUserCacheForgetsMissingUsers(self):
+        with server.app.test_request_context(headers={"X-Device-ID": "forgotten"}):
+            User.remember("forgotten", 1000000)
+            with self.assertRaises(ValueError):
+                User.get_user()
+            self.assertFalse(db.exists(User.device_key("forgotten")))
+
+            # A mapping to some other device's user is dropped too
+            other = User(platform="ios", device_id="someone-else")
+            sqldb.session.add(other)
+            sqldb.session.commit()
+            User.remember("forgotten", other.id)
+            self.assertEquals(User.find("forgotten"), None)
+            self.assertFalse(db.exists(User.device_key("forgotten")))
+
+    @mock.patch("penn.laundry.requests.get", fakeLaundryGet)
+    def testLaundryRooms(self):
+        with server.app.test_request_context():
+            res = json.loads(server.laundry.get_rooms("1,26").data.decode("utf8"))["rooms"]
+            self.assertEquals([x["id"] for x in res], [1, 26])
+            self.assertEquals(res[1]["hall_name"], "Harrison Floor 20")
+            for room in res:
+                self.assertEquals(len(room["usage_data"]["washer_data"]), 27)
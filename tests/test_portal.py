@@ -0,0 +1,147 @@
+import datetime
+import json
+import unittest
+
+import mock
+from flask import g
+
+import server
+from server.analytics import rebuild_post_analytics
+from server.models import (AnalyticsEvent, Post, PostAccount, PostFilter,
+                           PostStatus, PostTargetEmail, PostTester, User, sqldb)
+from server.portal.posts import get_analytics
+
+
+class PortalPostsTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        with server.app.app_context():
+            account = PostAccount(name="Labs", email="pennappslabs@gmail.com", encrypted_password="x")
+            other = PostAccount(name="Other", email="other@example.com", encrypted_password="x")
+            sqldb.session.add_all([account, other])
+            sqldb.session.commit()
+            self.account_id = account.id
+
+            self.post_ids = []
+            for i, owner in enumerate([account, account, account, other]):
+                post = Post(
+                    account=owner.id,
+                    title="Post %d" % i,
+                    image_url="https://example.com/%d.png" % i,
+                    image_url_cropped="https://example.com/%d-cropped.png" % i,
+                    start_date=datetime.datetime(2020, 1, 1),
+                    end_date=datetime.datetime(2020, 2, 1),
+                    approved=i == 0,
+                )
+                sqldb.session.add(post)
+                sqldb.session.commit()
+                self.post_ids.append(post.id)
+                sqldb.session.add_all(
+                    [
+                        PostFilter(post=post.id, type="class", filter="2021"),
+                        PostTester(post=post.id, email="tester%d@upenn.edu" % i),
+                        PostTargetEmail(post=post.id, email="target%d@upenn.edu" % i),
+                        PostStatus(post=post.id, status="submitted", created_at=datetime.datetime(2020, 1, 1)),
+                        PostStatus(post=post.id, status="approved", msg="ok", created_at=datetime.datetime(2020, 1, 2)),
+                    ]
+                )
+            sqldb.session.add(
+                AnalyticsEvent(
+                    timestamp=datetime.datetime(2020, 1, 3),
+                    type="post",
+                    index=0,
+                    post_id=str(self.post_ids[1]),
+                    is_interaction=True,
+                )
+            )
+            sqldb.session.add(
+                AnalyticsEvent(
+                    user=1,
+                    timestamp=datetime.datetime(2020, 1, 3),
+                    type="post",
+                    index=0,
+                    post_id=str(self.post_ids[1]),
+                    is_interaction=False,
+                )
+            )
+            sqldb.session.commit()
+
+    def setUp(self):
+        server.app.config["TESTING"] = True
+
+    def testAccountPostsPages(self):
+        with server.app.test_client() as c:
+            resp = c.get("/portal/posts?account=%s&limit=2" % self.account_id)
+            page = json.loads(resp.data.decode("utf8"))
+            self.assertTrue(g.query_stats.count <= 7)
+
+            self.assertEquals([post["id"] for post in page["posts"]], self.post_ids[:2])
+            self.assertEquals(page["next"], self.post_ids[1])
+            first, second = page["posts"]
+            self.assertEquals(first["organization"], "Labs")
+            self.assertEquals(first["filters"], [{"type": "class", "filter": "2021"}])
+            self.assertEquals(first["testers"], ["tester0@upenn.edu"])
+            self.assertEquals(first["emails"], ["target0@upenn.edu"])
+            self.assertEquals((first["status"], first["comments"]), ("approved", "ok"))
+            self.assertEquals(first["interactions"], 0)
+            self.assertEquals(
+                (second["interactions"], second["impressions"], second["unique_impressions"]), (1, 1, 1)
+            )
+
+            resp = c.get("/portal/posts?account=%s&limit=2&after=%d" % (self.account_id, page["next"]))
+            page = json.loads(resp.data.decode("utf8"))
+            self.assertEquals([post["id"] for post in page["posts"]], self.post_ids[2:3])
+            self.assertEquals(page["next"], None)
+
+    @mock.patch("server.portal.posts.POSTS_PAGE_SIZE", 1)
+    def testAccountPostsUnpaged(self):
+        with server.app.test_client() as c:
+            resp = c.get("/portal/posts?account=%s" % self.account_id)
+            page = json.loads(resp.data.decode("utf8"))
+        self.assertEquals([post["id"] for post in page["posts"]], self.post_ids[:3])
+        self.assertEquals(page["next"], None)
+
+    def testAllPosts(self):
+        with server.app.test_client() as c:
+            resp = c.get("/portal/posts/all?account=%s" % self.account_id)
+            page = json.loads(resp.data.decode("utf8"))
+            self.assertTrue(g.query_stats.count <= 8)
+        self.assertEquals([post["id"] for post in page["posts"]], self.post_ids)
+        self.assertEquals([post["organization"] for post in page["posts"]], ["Labs", "Labs", "Labs", "Other"])
+        self.assertEquals(page["next"], None)
+
+    def testAnalyticsRollups(self):
+        post_id = str(self.post_ids[2])
+        with server.app.app_context():
+            sqldb.session.add(User(platform="ios", device_id="analytics"))
+            sqldb.session.commit()
+
+        def event(timestamp, is_interaction):
+            return {
+                "timestamp": timestamp,
+                "cell_type": "post",
+                "index": 0,
+                "id": post_id,
+                "is_interaction": is_interaction,
+            }
+
+        events = [
+            event("2020-01-03T10:00:00.000", False),
+            event("2020-01-03T10:00:05.000", True),
+            event("2020-01-04T09:00:00.000", False),
+        ]
+        with mock.patch("server.analytics.POST_ANALYTICS_ROLLUP", True):
+            with server.app.test_client() as c:
+                c.post("/feed/analytics", headers={"X-Device-ID": "analytics"}, json=events[:2])
+                c.post("/feed/analytics", headers={"X-Device-ID": "analytics"}, json=events[2:])
+
+        with server.app.app_context():
+            raw = get_analytics([post_id, str(self.post_ids[1])])
+            self.assertEquals(raw, {post_id: (1, 2, 1), str(self.post_ids[1]): (1, 1, 1)})
+
+            with mock.patch("server.analytics.POST_ANALYTICS_ROLLUP", True):
+                self.assertEquals(get_analytics([post_id]), {post_id: (1, 2, 1)})
+
+                # Events sent before the rollups were turned on are added by a rebuild
+                rebuild_post_analytics()
+                self.assertEquals(get_analytics([post_id, str(self.post_ids[1])]), raw)
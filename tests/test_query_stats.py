@@ -0,0 +1,60 @@
+import datetime
+import json
+import unittest
+
+import mock
+from flask import g
+from pytz import timezone
+
+import server
+from server.base import cache_invalidate
+from server.laundry import usage_key
+from server.models import User, sqldb
+
+
+class QueryStatsTests(unittest.TestCase):
+    def setUp(self):
+        server.app.config["TESTING"] = True
+
+    def testServerTiming(self):
+        with server.app.test_client() as c:
+            resp = c.get("/laundry/preferences", headers={"X-Device-ID": "timing"})
+            self.assertEquals(g.query_stats.count, 1)
+        self.assertTrue(resp.headers["Server-Timing"].startswith("db;dur="))
+        self.assertTrue(resp.headers["Server-Timing"].endswith('desc="1 queries"'))
+
+    def testPreferencesQueryCount(self):
+        with server.app.test_client() as c:
+            headers = {"X-Device-ID": "counted"}
+            c.post("/laundry/preferences", headers=headers, data={"rooms": "1,2,3"})
+            resp = c.get("/laundry/preferences", headers=headers)
+            self.assertEquals(json.loads(resp.data.decode("utf8"))["rooms"], [1, 2, 3])
+            # The user, by primary key, and then their preferences
+            self.assertTrue(g.query_stats.count <= 2)
+
+    def testFanOutQueriesCounted(self):
+        now = datetime.datetime.now(timezone("EST"))
+        cache_invalidate(usage_key(1, now.year, now.month, now.day))
+        snapshot = {"halls": {"1": {"machines": {}, "hall_name": "Test Hall", "location": "Test"}}}
+        with mock.patch("server.laundry_snapshot.get_snapshot", return_value=snapshot):
+            with server.app.test_client() as c:
+                c.get("/laundry/rooms/1")
+                # The usage is loaded on a fan_out thread, but still counts toward the request
+                statements = list(g.query_stats.statements)
+        self.assertTrue(any("laundry_usage" in statement for statement in statements), statements)
+
+    def testRepeatedQueries(self):
+        with server.app.test_request_context():
+            server.app.preprocess_request()
+            for device_id in ["a", "b", "c"]:
+                User.query.filter_by(device_id=device_id).first()
+            sqldb.session.query(User).filter(User.id.in_([1, 2])).all()
+            sqldb.session.query(User).filter(User.id.in_([1, 2, 3])).all()
+
+            self.assertEquals(g.query_stats.count, 5)
+            self.assertEquals(len(g.query_stats.repeated(threshold=1)), 2)
+            with self.assertLogs("server.query_stats", "WARNING") as logs:
+                with mock.patch("server.query_stats.REPEATED_QUERY_THRESHOLD", 2):
+                    server.app.process_response(server.app.response_class())
+            self.assertEquals(len(logs.output), 1)
+            self.assertTrue("ran this statement 3 times" in logs.output[0])